@@ -0,0 +1,712 @@
+"""Benchmark updatr on a synthetic collection of photos.
+
+    python -m updatr.bench [N ...] [--jobs N] [--layout files|stream] [--base DIR]
+                           [--flickr] [--latency S] [--uploads N]
+                           [--calls-per-second N] [--failures P]
+    python -m updatr.bench --checkmeta [N ...] [--base DIR]
+    python -m updatr.bench --yaml [N ...] [--base DIR]
+
+For every N (default 1000) a collection of N small photos is generated,
+with metadata in the photos and in matching metadata records,
+as if `importmeta` has just been run.
+Then the commands that work on local files are timed on it, each in a fresh
+process, first with an empty metadata index, then with the index that the
+first run has left behind.
+For every command the number of photos per second and the peak memory are
+reported.
+
+With `--flickr` or `--latency S`, the commands that talk to Flickr are timed
+as well, end to end, against a stand-in for Flickr whose calls take S seconds
+(default 0): a full `sync`, `albumsort`, and after changing a tenth of the
+metadata records, `plan`, `sync` and `albumsync`.
+With `--calls-per-second N` the stand-in refuses calls that come faster,
+and with `--failures P` its changes fail with chance P,
+see `updatr.fakeflickr`.
+
+The collection is generated in a temporary directory, unless `--base DIR` is
+given: then it is generated in DIR and kept.
+
+With `--checkmeta`, nothing is timed. Instead, N photos (default 1000) get
+generated metadata written by `applyMeta`, hence by pyexiv2, with locations,
+non-ascii text and missing fields among them, and the fast reader must read
+from every photo exactly what pyexiv2 reads.
+
+With `--yaml`, N metadata files (default 10000) are dumped and loaded, with
+the pure Python `Dumper` and `FullLoader`, and with the dumper and loader that
+updatr uses, libyaml based if possible. The time per file is reported,
+and all of them must give the same text and the same data.
+"""
+
+import os
+import sys
+import json
+import struct
+import random
+import resource
+import subprocess
+import tempfile
+from time import perf_counter
+
+import yaml
+
+from . import updatr as U
+from .jpegmeta import IPTC_RESOURCE, readJpegInfo
+from .fakeflickr import FakeFlickr
+
+
+SOURCE = "bench"
+
+# the commands that are timed, in this order: importmeta changes the photos
+BENCHMARKS = (
+    ("exportmeta", None),
+    ("exportmeta", "full"),
+    ("exportmetafull", "force"),
+    ("getKeywords", None),
+    ("getDates", None),
+    ("importmeta", "force"),
+)
+
+# the commands that are timed against the stand-in for Flickr, in this order;
+# `change` is not a command: it changes a fraction CHANGED of the records
+FLICKR_BENCHMARKS = (
+    ("sync", "force"),
+    ("albumsort", None),
+    ("change", None),
+    ("plan", None),
+    ("sync", None),
+    ("albumsync", None),
+)
+CHANGED = 0.1
+
+# the options that set the behaviour of the stand-in for Flickr
+FAKE_OPTIONS = {
+    "--latency": ("latency", float),
+    "--calls-per-second": ("callsPerSecond", int),
+    "--failures": ("failures", float),
+}
+VALUED = {"--jobs", "--uploads", "--layout", "--base", *FAKE_OPTIONS}
+FLICKR_SETTINGS = dict(
+    flickrKey="bench",
+    flickrSecret="bench",
+    flickrUserId="bench",
+    rateLimit=dict(callsPerHour=36_000_000, burst=100),
+)
+
+CONFIG = dict(
+    albumName="Bench",
+    colofon="Foto: {author}; bewerker: {writer}\n{copyright}",
+    metaDefaults=dict(
+        source="bench",
+        credit="https://example.org/bench",
+        author="onbekend",
+        writer="updatr",
+        copyright="© zie {credit}/{sourceAsUrl}.txt",
+        caption="bench photo",
+        keywords=["bench"],
+    ),
+)
+
+WORDS = """
+    kerk molen brug gracht haven markt toren dijk polder sluis school station
+    boerderij kasteel dorp stad straat plein veld bos strand duin rivier kade
+    fabriek winkel huis tuin park weg schip trein fiets paard koe optocht feest
+    bruiloft doop familie klas vereniging koor kermis oogst winter zomer
+""".split()
+KEYWORDS = [f"{word}{i}" if i else word for i in range(4) for word in WORDS]
+
+# a 1x1 grey baseline jpeg, without the start of image marker
+JPEG_BODY = bytes.fromhex(
+    "ffdb004300"
+    + "01" * 64
+    + "ffc0000b080001000101011100"
+    + "ffc4001f0000010501010101010100000000000000000102030405060708090a0b"
+    + "ffda0008010100003f00d2cf20ffd9"
+)
+JFIF = b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+
+ASCII = 2
+BYTE = 1
+LONG = 4
+RATIONAL = 5
+
+EXIF_TAGS = (
+    ("caption", 0x010E),
+    ("datetime", 0x0132),
+    ("author", 0x013B),
+    ("copyright", 0x8298),
+    ("datetime", 0x9003),
+)
+IPTC_TAGS = (
+    ("keywords", 25),
+    ("author", 80),
+    ("credit", 110),
+    ("source", 115),
+    ("copyright", 116),
+    ("caption", 120),
+    ("writer", 122),
+)
+# the iptc envelope that says that the strings are in utf-8
+IPTC_ENVELOPE = b"\x1c\x01\x5a\x00\x03\x1b\x25\x47"
+
+
+def makeRecord(rnd, i):
+    """A metadata record for the i-th photo, much like real ones."""
+    record = dict(caption=" ".join(rnd.choices(WORDS, k=rnd.randint(2, 12))))
+    weights = [1 / (k + 1) for k in range(len(KEYWORDS))]
+    record["keywords"] = sorted(
+        set(rnd.choices(KEYWORDS, weights=weights, k=rnd.randint(1, 5)))
+    )
+    if rnd.random() < 0.9:
+        record["datetime"] = (
+            f"{rnd.randint(1890, 2020)}:{rnd.randint(1, 12):02d}:"
+            f"{rnd.randint(1, 28):02d} {rnd.randint(0, 23):02d}:"
+            f"{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d}"
+        )
+    if rnd.random() < 0.6:
+        lat = round(rnd.uniform(50.8, 53.5), 6)
+        lng = round(rnd.uniform(3.4, 7.2), 6)
+        record["location"] = f"lat={lat} lng={lng} alt="
+    if rnd.random() < 0.5:
+        record["source"] = f"archive-{i:06d}"
+    return record
+
+
+def ifd(entries, bo, offset):
+    """Encode a tiff directory at `offset`, with its values after it."""
+    head = struct.pack(f"{bo}H", len(entries))
+    dataPos = offset + 2 + 12 * len(entries) + 4
+    data = b""
+
+    for (tag, tp, count, raw) in sorted(entries):
+        if len(raw) <= 4:
+            head += struct.pack(f"{bo}HHL", tag, tp, count) + raw.ljust(4, b"\x00")
+        else:
+            head += struct.pack(f"{bo}HHLL", tag, tp, count, dataPos + len(data))
+            data += raw + b"\x00" * (len(raw) % 2)
+
+    return head + struct.pack(f"{bo}L", 0) + data
+
+
+def asciiEntry(tag, text):
+    raw = text.encode("utf8") + b"\x00"
+    return (tag, ASCII, len(raw), raw)
+
+
+def rationalEntry(tag, values, bo):
+    raw = b"".join(
+        struct.pack(f"{bo}LL", val.numerator, val.denominator) for val in values
+    )
+    return (tag, RATIONAL, len(values), raw)
+
+
+def gpsEntries(location, bo):
+    entries = [asciiEntry(0x0012, "WGS-84")]
+
+    for (fieldRe, refVals, refTag, tag) in (
+        (U.LAT_RE, ("N", "S"), 0x0001, 0x0002),
+        (U.LNG_RE, ("E", "W"), 0x0003, 0x0004),
+    ):
+        val = fieldRe.findall(location)
+        if val and val[0]:
+            val = float(val[0])
+            entries.append(asciiEntry(refTag, refVals[0] if val >= 0 else refVals[1]))
+            entries.append(rationalEntry(tag, U.decimal_to_dms(val), bo))
+
+    return entries
+
+
+def exifSegment(actual):
+    """The exif segment with the values that `applyMeta` writes."""
+    bo = ">"
+    entries = [
+        asciiEntry(tag, actual[log]) for (log, tag) in EXIF_TAGS if actual.get(log)
+    ]
+
+    location = actual.get("location", None)
+    if location:
+        gps = gpsEntries(location, bo)
+        # the gps directory follows the main directory,
+        # whose size does not depend on the value of the pointer to it
+        entries.append((0x8825, LONG, 1, b"\x00" * 4))
+        gpsPos = 8 + len(ifd(entries, bo, 8))
+        entries[-1] = (0x8825, LONG, 1, struct.pack(f"{bo}L", gpsPos))
+        tiff = ifd(entries, bo, 8) + ifd(gps, bo, gpsPos)
+    else:
+        tiff = ifd(entries, bo, 8)
+
+    return b"Exif\x00\x00MM" + struct.pack(f"{bo}HL", 42, 8) + tiff
+
+
+def iptcSegment(actual):
+    """The photoshop segment with the iptc values that `applyMeta` writes."""
+    datasets = []
+    for (log, dataset) in IPTC_TAGS:
+        val = actual.get(log, None)
+        if val is None:
+            continue
+        for v in val if log == "keywords" else [val]:
+            datasets.append((dataset, v.encode("utf8")))
+
+    datetime = actual.get("datetime", None)
+    if datetime:
+        (date, time) = datetime.split(" ")
+        date = date.replace(":", "").encode("ascii")
+        time = f"{time.replace(':', '')}+0000".encode("ascii")
+        datasets.extend(((55, date), (60, time), (62, date), (63, time)))
+
+    iptc = IPTC_ENVELOPE + b"".join(
+        struct.pack(">BBBH", 0x1C, 2, dataset, len(raw)) + raw
+        for (dataset, raw) in sorted(datasets, key=lambda x: x[0])
+    )
+    block = (
+        b"8BIM"
+        + struct.pack(">HBBL", IPTC_RESOURCE, 0, 0, len(iptc))
+        + iptc
+        + b"\x00" * (len(iptc) % 2)
+    )
+    return b"Photoshop 3.0\x00" + block
+
+
+def segment(marker, data):
+    return bytes((0xFF, marker)) + struct.pack(">H", len(data) + 2) + data
+
+
+def makePhoto(actual):
+    return (
+        b"\xff\xd8"
+        + segment(0xE0, JFIF)
+        + segment(0xE1, exifSegment(actual))
+        + segment(0xED, iptcSegment(actual))
+        + JPEG_BODY
+    )
+
+
+def generate(base, n, layout, seed=1):
+    """Generate a collection of `n` photos with their metadata under `base`.
+
+    The photos get the metadata that `importmeta` would give them from the
+    records. The files that updatr needs in its local directory are made as
+    well, in `base/_local`.
+    """
+    rnd = random.Random(seed)
+    config = dict(CONFIG, metaLayout=layout)
+    defaults = config["metaDefaults"]
+
+    sourceDir = f"{base}/{SOURCE}"
+    localDir = f"{base}/_local"
+    photosDir = f"{sourceDir}/photos"
+    os.makedirs(photosDir, exist_ok=True)
+    os.makedirs(localDir, exist_ok=True)
+
+    with open(f"{sourceDir}/config.yaml", "w") as fh:
+        U.writeYaml(config, fh)
+    with open(f"{localDir}/flickr.yaml", "w") as fh:
+        U.writeYaml(FLICKR_SETTINGS, fh)
+
+    store = U.STORES[layout](f"{sourceDir}/metadata")
+
+    for i in range(n):
+        name = f"photo{i:06d}"
+        record = makeRecord(rnd, i)
+        store.put(name, record)
+        actual = U.recordMeta(record, defaults, config["colofon"])
+        with open(f"{photosDir}/{name}.jpg", "wb") as fh:
+            fh.write(makePhoto(actual))
+
+    store.flush()
+
+
+# records with text beyond ascii, for checking the readers
+UNICODE_RECORD = dict(
+    caption="Café „De Gouden Leeuw” — Straße, 北京, ✓\nop de tweede regel",
+    keywords=["één", "straße", "北京"],
+    source="archief/één",
+)
+# defaults that leave nearly all fields of a photo empty
+BARE_DEFAULTS = dict(keywords=[])
+
+
+def checkRecord(rnd, i):
+    """A record, defaults and colofon for the i-th photo when checking readers.
+
+    Next to records as `makeRecord` makes them, there are records with
+    non-ascii text, with locations in all quarters of the world,
+    and with missing fields.
+    """
+    defaults = CONFIG["metaDefaults"]
+    colofon = CONFIG["colofon"]
+    record = makeRecord(rnd, i)
+    case = i % 5
+
+    if case == 1:
+        record.update(UNICODE_RECORD)
+    elif case == 2:
+        lat = round(rnd.uniform(-89.9, 89.9), 6)
+        lng = round(rnd.uniform(-179.9, 179.9), 6)
+        record["location"] = f"lat={lat} lng={lng} alt="
+    elif case == 3:
+        record = {}
+    elif case == 4:
+        record = dict(caption=record["caption"])
+        defaults = BARE_DEFAULTS
+        colofon = ""
+
+    return (record, defaults, colofon)
+
+
+def checkMeta(base, n, seed=1):
+    """Compare the fast reader with pyexiv2 on photos written by pyexiv2.
+
+    Returns the number of photos where they do not agree.
+    """
+    rnd = random.Random(seed)
+    photosDir = f"{base}/photos"
+    os.makedirs(photosDir, exist_ok=True)
+
+    same = 0
+    different = 0
+
+    for i in range(n):
+        name = f"photo{i:06d}"
+        path = f"{photosDir}/{name}.jpg"
+        with open(path, "wb") as fh:
+            fh.write(b"\xff\xd8" + segment(0xE0, JFIF) + JPEG_BODY)
+
+        (record, defaults, colofon) = checkRecord(rnd, i)
+        error = U.applyMeta(record, None, path, defaults, colofon)
+        if error is not None:
+            U.console(f"\t{name}: {error}", error=True)
+            different += 1
+            continue
+
+        info = readJpegInfo(path)
+        full = U.readPhotoMeta(path, fast=False)
+        if info is None:
+            U.console(f"\t{name}: not decoded by the fast reader", error=True)
+            different += 1
+            continue
+
+        fast = U.extractMeta(info)
+        if fast == full:
+            same += 1
+            continue
+
+        different += 1
+        U.console(f"\t{name}:", error=True)
+        for (log, val) in full.items():
+            if fast[log] != val:
+                U.console(f"\t\t{log}: {fast[log]!r} versus {val!r}", error=True)
+
+    U.console(
+        f"""Compare Metadata Readers
+Same      : {same:>4}
+Different : {different:>4}
+"""
+    )
+    return different
+
+
+def yamlRecord(rnd, i):
+    """A metadata record for the i-th photo, as in the metadata directories.
+
+    Half of them are as `exportmetafull` writes them: with all fields,
+    and captions with the colofon.
+    """
+    record = checkRecord(rnd, i)[0]
+    if i % 2:
+        record = U.recordMeta(record, CONFIG["metaDefaults"], CONFIG["colofon"])
+    return record
+
+
+def yamlBench(base, n, seed=1):
+    """Time loading and dumping metadata files with and without libyaml.
+
+    The pure Python `FullLoader` and `Dumper` are compared with the loader
+    and dumper that updatr uses, on `n` files, one per record.
+    Returns the number of records where they do not give the same result.
+    """
+    rnd = random.Random(seed)
+    records = [yamlRecord(rnd, i) for i in range(n)]
+    paths = [f"{base}/photo{i:06d}.yaml" for i in range(n)]
+    os.makedirs(base, exist_ok=True)
+
+    def dump(dumper):
+        texts = []
+        start = perf_counter()
+        for (record, path) in zip(records, paths):
+            with open(path, "w") as fh:
+                yaml.dump(record, fh, Dumper=dumper, allow_unicode=True)
+        seconds = perf_counter() - start
+        for path in paths:
+            with open(path) as fh:
+                texts.append(fh.read())
+        return (seconds, texts)
+
+    def load(loader):
+        data = []
+        start = perf_counter()
+        for path in paths:
+            with open(path) as fh:
+                data.append(yaml.load(fh, Loader=loader))
+        return (perf_counter() - start, data)
+
+    (dumpBefore, textsBefore) = dump(yaml.Dumper)
+    (dumpAfter, textsAfter) = dump(U.YAML_DUMPER)
+    (loadBefore, dataBefore) = load(yaml.FullLoader)
+    (loadAfter, dataAfter) = load(U.YAML_LOADER)
+
+    U.console(f"{'':<6} {'with':<12} {'us/file':>9}")
+    for (what, tool, seconds) in (
+        ("dump", yaml.Dumper, dumpBefore),
+        ("dump", U.YAML_DUMPER, dumpAfter),
+        ("load", yaml.FullLoader, loadBefore),
+        ("load", U.YAML_LOADER, loadAfter),
+    ):
+        U.console(f"{what:<6} {tool.__name__:<12} {seconds / n * 1e6:>9.0f}")
+
+    different = 0
+    for (i, record) in enumerate(records):
+        if (
+            textsBefore[i] != textsAfter[i]
+            or dataBefore[i] != record
+            or dataAfter[i] != record
+        ):
+            different += 1
+            U.console(f"\t{paths[i]}: not the same", error=True)
+
+    U.console(
+        f"""Compare YAML Loaders and Dumpers
+Same      : {n - different:>4}
+Different : {different:>4}
+"""
+    )
+    return different
+
+
+def setBase(base):
+    localDir = f"{base}/_local"
+    U.IMAGE_BASE = base
+    U.LOCAL_DIR = localDir
+    U.FLICKR_CONFIG = f"{localDir}/flickr.yaml"
+
+
+def peakMemory():
+    """Peak memory in MB of this process and of its finished workers."""
+    scale = 1 if sys.platform == "darwin" else 1024
+    peak = max(
+        resource.getrusage(who).ru_maxrss
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)
+    )
+    return peak * scale / 1e6
+
+
+def runOne(base, command, flag, options, fakePath=None):
+    """Run a single command on the collection in `base`, in this process.
+
+    If `fakePath` is given, the command talks to the stand-in for Flickr
+    with the account in that file.
+    Prints the seconds it took, the peak memory and the calls to Flickr,
+    in json, on the last line.
+    """
+    setBase(base)
+    if fakePath is None:
+        Mk = U.Make(SOURCE, None, options=options)
+    else:
+
+        def flickr(C, names):
+            return FakeFlickr.open(fakePath, C.photosDir, names, C.albumName)
+
+        Mk = U.Make(SOURCE, None, options=options, flickr=flickr)
+
+    start = perf_counter()
+    if command in {"getKeywords", "getDates"}:
+        getattr(Mk, command)()
+        Mk.index.commit()
+    else:
+        Mk.doCommand(command, flag)
+    seconds = perf_counter() - start
+
+    calls = Mk.limiter.calls
+    print(json.dumps(dict(seconds=seconds, memory=peakMemory(), calls=calls)))
+
+
+def runFresh(base, command, flag, options, fakePath=None):
+    """Run a single command on the collection in `base`, in a fresh process."""
+    packageDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pythonPath = os.environ.get("PYTHONPATH", None)
+    env = dict(
+        os.environ,
+        PYTHONPATH=packageDir
+        if pythonPath is None
+        else os.pathsep.join((packageDir, pythonPath)),
+    )
+    args = [sys.executable, "-m", "updatr.bench", "--one", base, command]
+    args.append(json.dumps(options))
+    args.append(json.dumps(fakePath))
+    if flag is not None:
+        args.append(flag)
+
+    result = subprocess.run(args, env=env, capture_output=True, text=True)
+    if result.returncode:
+        U.console(result.stderr.strip().split("\n")[-1], error=True)
+        return None
+    return json.loads(result.stdout.strip().split("\n")[-1])
+
+
+def changeRecords(base, layout, fraction, seed=2):
+    """Change the caption, keywords and sometimes the date of some records."""
+    rnd = random.Random(seed)
+    store = U.STORES[layout](f"{base}/{SOURCE}/metadata")
+    names = store.names()
+
+    for name in rnd.sample(names, max(1, int(len(names) * fraction))):
+        record = dict(store.get(name))
+        record["caption"] = f"{record['caption']} bewerkt"
+        keywords = set(record["keywords"])
+        keywords.add(rnd.choice(KEYWORDS))
+        record["keywords"] = sorted(keywords)
+        if "datetime" in record and rnd.random() < 0.5:
+            record["datetime"] = f"{rnd.randint(1890, 2020)}{record['datetime'][4:]}"
+        store.put(name, record)
+
+    store.flush()
+
+
+def bench(base, n, layout, options, flickr):
+    start = perf_counter()
+    generate(base, n, layout)
+    U.console(
+        f"Generated {n} photos with {layout} metadata "
+        f"in {perf_counter() - start:.1f}s"
+    )
+
+    indexPath = f"{base}/_local/{SOURCE}/{U.INDEX_FILE}"
+    results = []
+
+    def report(label, run, result):
+        if result is None:
+            U.console(f"{label:<24} {run:<6} failed", error=True)
+            return
+
+        seconds = result["seconds"]
+        rate = n / seconds if seconds else 0
+        U.console(
+            f"{label:<24} {run:<6} {seconds:>8.2f} {rate:>9.0f} "
+            f"{result['memory']:>7.1f} {result['calls']:>7}"
+        )
+        results.append(dict(command=label, run=run, photos=n, rate=rate, **result))
+
+    U.console(
+        f"{'command':<24} {'run':<6} {'seconds':>8} {'photos/s':>9} "
+        f"{'MB':>7} {'calls':>7}"
+    )
+
+    for (command, flag) in BENCHMARKS:
+        label = command if flag is None else f"{command} {flag}"
+
+        for run in ("cold", "warm"):
+            if run == "cold" and os.path.exists(indexPath):
+                os.remove(indexPath)
+            report(label, run, runFresh(base, command, flag, options))
+
+    if flickr is not None:
+        photosDir = f"{base}/{SOURCE}/photos"
+        names = sorted(f.removesuffix(".jpg") for f in os.listdir(photosDir))
+        fakePath = f"{base}/_local/fakeflickr.json"
+        fake = FakeFlickr.open(fakePath, photosDir, names, CONFIG["albumName"])
+        fake.settings.update(flickr)
+        fake.save()
+
+        for (command, flag) in FLICKR_BENCHMARKS:
+            if command == "change":
+                changeRecords(base, layout, CHANGED)
+                continue
+            label = command if flag is None else f"{command} {flag}"
+            result = runFresh(base, command, flag, options, fakePath=fakePath)
+            report(label, "flickr", result)
+
+    return results
+
+
+def main():
+    args = sys.argv[1:]
+
+    if args[0:1] == ["--one"]:
+        (base, command, options, fakePath, *flag) = args[1:]
+        flag = flag[0] if flag else None
+        runOne(base, command, flag, json.loads(options), json.loads(fakePath))
+        return 0
+
+    sizes = []
+    mode = None
+    options = {}
+    layout = "files"
+    base = None
+    flickr = None
+
+    while args:
+        arg = args.pop(0)
+        (option, hasValue, value) = arg.partition("=")
+        if option in VALUED:
+            if not hasValue:
+                if not args:
+                    U.console(__doc__)
+                    U.console(f"Missing value for option `{arg}`")
+                    return 1
+                value = args.pop(0)
+
+        if option in {"--jobs", "--uploads"}:
+            options[option[2:]] = int(value)
+        elif option in {"--checkmeta", "--yaml"}:
+            mode = option[2:]
+        elif option == "--flickr":
+            flickr = {} if flickr is None else flickr
+        elif option in FAKE_OPTIONS:
+            (setting, tp) = FAKE_OPTIONS[option]
+            flickr = {} if flickr is None else flickr
+            flickr[setting] = tp(value)
+        elif option == "--layout":
+            if value not in U.STORES:
+                U.console(f"Unknown layout `{value}`")
+                return 1
+            layout = value
+        elif option == "--base":
+            base = value
+        elif arg.isdigit():
+            sizes.append(int(arg))
+        else:
+            U.console(__doc__)
+            U.console(f"Unknown argument `{arg}`")
+            return 1
+
+    if mode is not None:
+        (check, default, what) = dict(
+            checkmeta=(checkMeta, 1000, "the metadata readers on {n} photos"),
+            yaml=(yamlBench, 10000, "yaml on {n} metadata files"),
+        )[mode]
+        different = 0
+        for n in sizes or [default]:
+            U.console(f"Check {what.format(n=n)}")
+            if base is None:
+                with tempfile.TemporaryDirectory() as tmpDir:
+                    different += check(tmpDir, n)
+            else:
+                different += check(f"{base}/{mode}-{n}", n)
+        return 1 if different else 0
+
+    for n in sizes or [1000]:
+        optionStr = " ".join(f"{k} {v}" for (k, v) in options.items())
+        U.console(f"Benchmark with {n} photos {optionStr}")
+        if base is None:
+            with tempfile.TemporaryDirectory() as tmpDir:
+                bench(tmpDir, n, layout, options, flickr)
+        else:
+            sizeBase = f"{base}/{n}"
+            os.makedirs(sizeBase, exist_ok=True)
+            bench(sizeBase, n, layout, options, flickr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,395 @@
+"""A stand-in for Flickr, to run updatr without talking to Flickr.
+
+It keeps the photos and albums of a single account, and answers the calls
+that updatr makes in the way that `flickrapi.FlickrAPI` does with the format
+`parsed-json`: the methods sit in the same places, such as
+`photosets.getPhotos`, and return the same structures, as far as updatr
+uses them.
+
+The benchmark passes it to `Make` as its connection to Flickr.
+The account is kept in a json file, so that it lives on between runs.
+The settings in that file shape the behaviour:
+
+*   latency: seconds that every call takes;
+*   uploadSpeed: bytes per second for `replace`, on top of the latency;
+    0 means: no time at all;
+*   perPage: the maximum number of photos per page in listings;
+*   callsPerSecond: if calls come faster than this, they fail with
+    status 429, as Flickr does when it is called too fast; 0 means: no limit;
+*   failures: the chance that a call that changes something fails;
+*   seed: for the random failures.
+"""
+
+import os
+import json
+import random
+import threading
+from collections import deque
+from time import sleep, monotonic, time
+
+from flickrapi.exceptions import FlickrError
+
+from .jpegmeta import readJpegInfo
+
+
+SETTINGS = dict(
+    latency=0.0,
+    uploadSpeed=0,
+    perPage=500,
+    callsPerSecond=0,
+    failures=0.0,
+    seed=1,
+)
+
+# Flickr error codes
+NOT_FOUND = 1
+ALREADY_IN = 3
+
+
+def dateTaken(path):
+    """The date that Flickr takes from a photo file, in the format of Flickr."""
+    info = readJpegInfo(path)
+    if info is None:
+        return ""
+    for key in ("Exif.Image.DateTimeOriginal", "Exif.Image.DateTime"):
+        if key in info.exif:
+            return info[key].raw_value.replace(":", "-", 2)
+    return ""
+
+
+class Method:
+    """A method of the Flickr API, as `flickrapi` has it."""
+
+    def __init__(self, flickr, name, fn, changes):
+        self.flickr = flickr
+        self.method_name = f"flickr.{name}"
+        self.fn = fn
+        self.changes = changes
+
+    def __call__(self, *args, **kwargs):
+        return self.flickr.call(self, args, kwargs)
+
+
+class Methods:
+    pass
+
+
+class FakeFlickr:
+    """An account on Flickr, in memory, with the methods that updatr calls.
+
+    `pictures` maps photo ids to a dict with the title, the date taken,
+    the description, the tags and the time of the last update;
+    `sets` maps album ids to a dict with the title, the primary photo,
+    the ids of its photos and the time of the last update.
+    """
+
+    def __init__(self, path=None, pictures=None, sets=None, settings=None):
+        self.path = path
+        self.pictures = {} if pictures is None else pictures
+        self.sets = {} if sets is None else sets
+        self.settings = dict(SETTINGS)
+        self.settings.update(settings or {})
+
+        self.lastId = max((int(i) for i in (*self.pictures, *self.sets)), default=0)
+        self.lock = threading.Lock()
+        self.random = random.Random(self.settings["seed"])
+        self.recent = deque()
+        self.calls = {}
+        self.bytes = 0
+
+        api = dict(
+            photosets=dict(
+                getList=(self.setGetList, False),
+                getPhotos=(self.setGetPhotos, False),
+                create=(self.setCreate, True),
+                editPhotos=(self.setEditPhotos, True),
+                reorderPhotos=(self.setReorderPhotos, True),
+                addPhoto=(self.setAddPhoto, True),
+                removePhotos=(self.setRemovePhotos, True),
+                setPrimaryPhoto=(self.setSetPrimaryPhoto, True),
+            ),
+            people=dict(getPhotos=(self.peopleGetPhotos, False)),
+            photos=dict(
+                recentlyUpdated=(self.photoRecentlyUpdated, False),
+                setMeta=(self.photoSetMeta, True),
+                setTags=(self.photoSetTags, True),
+                setDates=(self.photoSetDates, True),
+            ),
+        )
+        api["photos.geo"] = dict(
+            setLocation=(self.photoSetLocation, True),
+            removeLocation=(self.photoRemoveLocation, True),
+        )
+
+        for (group, methods) in api.items():
+            namespace = Methods()
+            for (name, (fn, changes)) in methods.items():
+                method = Method(self, f"{group}.{name}", fn, changes)
+                setattr(namespace, name, method)
+            if group == "photos.geo":
+                self.photos.geo = namespace
+            else:
+                setattr(self, group, namespace)
+
+        self.replace = Method(self, "replace", self.photoReplace, True)
+
+    @classmethod
+    def open(cls, path, photosDir, names, albumName):
+        """The account in the file at `path`.
+
+        If there is no such file yet, the account gets a photo for each name
+        in `names`, all in a single album called `albumName`,
+        as after a bulk upload of the photos in `photosDir` to Flickr.
+        """
+        if os.path.exists(path):
+            with open(path) as fh:
+                data = json.load(fh)
+            return cls(path, data["pictures"], data["sets"], data["settings"])
+
+        now = int(time())
+        pictures = {
+            str(i): dict(
+                title=name,
+                datetaken=dateTaken(f"{photosDir}/{name}.jpg"),
+                description="",
+                tags="",
+                update=now,
+            )
+            for (i, name) in enumerate(names, start=1)
+        }
+        photoIds = list(pictures)
+        sets = {}
+        if photoIds:
+            sets[str(len(photoIds) + 1)] = dict(
+                title=albumName, primary=photoIds[0], photos=photoIds, update=now
+            )
+        return cls(path, pictures, sets)
+
+    def save(self):
+        data = dict(settings=self.settings, pictures=self.pictures, sets=self.sets)
+        tmpPath = f"{self.path}.tmp"
+        with open(tmpPath, "w") as fh:
+            json.dump(data, fh)
+        os.replace(tmpPath, self.path)
+
+    def token_valid(self, perms=None):
+        return True
+
+    def call(self, method, args, kwargs):
+        """Make a call, with the latency, the rate limit and the failures."""
+        settings = self.settings
+        name = method.method_name.removeprefix("flickr.")
+
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            now = monotonic()
+            recent = self.recent
+            recent.append(now)
+            while recent[0] < now - 1:
+                recent.popleft()
+            tooFast = settings["callsPerSecond"] and (
+                len(recent) > settings["callsPerSecond"]
+            )
+            fails = method.changes and self.random.random() < settings["failures"]
+
+        if settings["latency"]:
+            sleep(settings["latency"])
+        if tooFast:
+            raise FlickrError("Status code 429 received")
+        if fails:
+            raise FlickrError("Status code 500 received")
+
+        return method.fn(*args, **kwargs)
+
+    def newId(self):
+        self.lastId += 1
+        return str(self.lastId)
+
+    def getPicture(self, photoId):
+        if photoId not in self.pictures:
+            raise FlickrError(f"Error: {NOT_FOUND}: Photo not found", code=NOT_FOUND)
+        return self.pictures[photoId]
+
+    def getSet(self, photosetId):
+        if photosetId not in self.sets:
+            raise FlickrError(f"Error: {NOT_FOUND}: Photoset not found", code=NOT_FOUND)
+        return self.sets[photosetId]
+
+    def page(self, key, photos, page, perPage):
+        perPage = min(int(perPage), self.settings["perPage"])
+        page = int(page)
+        pages = max(1, -(-len(photos) // perPage))
+        start = (page - 1) * perPage
+        return {
+            key: dict(
+                page=page,
+                pages=pages,
+                perpage=perPage,
+                total=len(photos),
+                photo=photos[start : start + perPage],
+            )
+        }
+
+    def photoInfo(self, photoId, extras):
+        picture = self.pictures[photoId]
+        info = dict(id=photoId, title=picture["title"])
+        extras = set((extras or "").split(","))
+        if "date_taken" in extras:
+            info["datetaken"] = picture["datetaken"]
+        if "tags" in extras:
+            info["tags"] = picture["tags"]
+        if "description" in extras:
+            info["description"] = dict(_content=picture["description"])
+        if "last_update" in extras:
+            info["lastupdate"] = str(picture["update"])
+        return info
+
+    # photosets
+
+    def setGetList(self, user_id=None, **kwargs):
+        with self.lock:
+            photosets = [
+                dict(
+                    id=photosetId,
+                    title=dict(_content=album["title"]),
+                    primary=album["primary"],
+                    photos=len(album["photos"]),
+                    videos=0,
+                    date_update=str(album["update"]),
+                )
+                for (photosetId, album) in self.sets.items()
+            ]
+        return dict(photosets=dict(page=1, pages=1, photoset=photosets))
+
+    def setGetPhotos(
+        self, photoset_id=None, extras=None, page=1, per_page=500, **kwargs
+    ):
+        with self.lock:
+            album = self.getSet(photoset_id)
+            photos = [self.photoInfo(i, extras) for i in album["photos"]]
+        result = self.page("photoset", photos, page, per_page)
+        result["photoset"].update(id=photoset_id, primary=album["primary"])
+        return result
+
+    def setCreate(self, title=None, primary_photo_id=None, **kwargs):
+        with self.lock:
+            self.getPicture(primary_photo_id)
+            photosetId = self.newId()
+            self.sets[photosetId] = dict(
+                title=title,
+                primary=primary_photo_id,
+                photos=[primary_photo_id],
+                update=int(time()),
+            )
+        return dict(photoset=dict(id=photosetId))
+
+    def setEditPhotos(self, photoset_id=None, primary_photo_id=None, photo_ids=""):
+        with self.lock:
+            album = self.getSet(photoset_id)
+            photoIds = photo_ids.split(",")
+            for photoId in photoIds:
+                self.getPicture(photoId)
+            if primary_photo_id not in photoIds:
+                raise FlickrError("Error: 2: Primary photo not in list", code=2)
+            album.update(primary=primary_photo_id, photos=photoIds, update=int(time()))
+        return {}
+
+    def setReorderPhotos(self, photoset_id=None, photo_ids=""):
+        with self.lock:
+            album = self.getSet(photoset_id)
+            photoIds = photo_ids.split(",")
+            present = set(album["photos"])
+            if any(photoId not in present for photoId in photoIds):
+                raise FlickrError(
+                    f"Error: {NOT_FOUND}: Photo not in set", code=NOT_FOUND
+                )
+            moved = set(photoIds)
+            rest = [photoId for photoId in album["photos"] if photoId not in moved]
+            album.update(photos=photoIds + rest, update=int(time()))
+        return {}
+
+    def setAddPhoto(self, photoset_id=None, photo_id=None):
+        with self.lock:
+            album = self.getSet(photoset_id)
+            self.getPicture(photo_id)
+            if photo_id in album["photos"]:
+                raise FlickrError(
+                    f"Error: {ALREADY_IN}: Photo already in set", code=ALREADY_IN
+                )
+            album["photos"].append(photo_id)
+            album["update"] = int(time())
+        return {}
+
+    def setRemovePhotos(self, photoset_id=None, photo_ids=""):
+        with self.lock:
+            album = self.getSet(photoset_id)
+            removed = set(photo_ids.split(","))
+            album["photos"] = [i for i in album["photos"] if i not in removed]
+            if not album["photos"]:
+                # Flickr deletes albums that become empty
+                del self.sets[photoset_id]
+                return {}
+            if album["primary"] in removed:
+                album["primary"] = album["photos"][0]
+            album["update"] = int(time())
+        return {}
+
+    def setSetPrimaryPhoto(self, photoset_id=None, photo_id=None):
+        with self.lock:
+            album = self.getSet(photoset_id)
+            if photo_id not in album["photos"]:
+                raise FlickrError(
+                    f"Error: {NOT_FOUND}: Photo not in set", code=NOT_FOUND
+                )
+            album["primary"] = photo_id
+        return {}
+
+    # photos
+
+    def peopleGetPhotos(self, user_id=None, extras=None, page=1, per_page=100, **k):
+        with self.lock:
+            photos = [self.photoInfo(i, extras) for i in self.pictures]
+        return self.page("photos", photos, page, per_page)
+
+    def photoRecentlyUpdated(self, min_date=0, extras=None, page=1, per_page=100):
+        with self.lock:
+            photos = [
+                self.photoInfo(i, extras)
+                for (i, picture) in self.pictures.items()
+                if picture["update"] >= int(min_date)
+            ]
+        return self.page("photos", photos, page, per_page)
+
+    def changePicture(self, photoId, **values):
+        with self.lock:
+            picture = self.getPicture(photoId)
+            picture.update(values, update=int(time()))
+        return {}
+
+    def photoSetMeta(self, photo_id=None, title=None, description=None):
+        values = {} if title is None else dict(title=title)
+        if description is not None:
+            values["description"] = description
+        return self.changePicture(photo_id, **values)
+
+    def photoSetTags(self, photo_id=None, tags=""):
+        return self.changePicture(photo_id, tags=tags)
+
+    def photoSetDates(self, photo_id=None, date_taken=None, **kwargs):
+        return self.changePicture(photo_id, datetaken=date_taken)
+
+    def photoSetLocation(self, photo_id=None, lat=None, lon=None, **kwargs):
+        return self.changePicture(photo_id, location=[float(lat), float(lon)])
+
+    def photoRemoveLocation(self, photo_id=None):
+        return self.changePicture(photo_id, location=None)
+
+    def photoReplace(self, filename, photo_id, fileobj, format=None):
+        data = fileobj.read()
+        uploadSpeed = self.settings["uploadSpeed"]
+        if uploadSpeed:
+            sleep(len(data) / uploadSpeed)
+        with self.lock:
+            self.bytes += len(data)
+        # Flickr takes the date from the new file
+        return self.changePicture(photo_id, datetaken=dateTaken(filename))
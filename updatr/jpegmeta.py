@@ -0,0 +1,456 @@
+"""Header-only reader for the metadata that updatr needs from a JPEG file.
+
+It scans the segments of a JPEG file up to the start of the image data,
+and decodes only the EXIF tags and IPTC datasets that updatr works with.
+
+The result mimics the part of `pyexiv2.ImageMetadata` that updatr uses for
+reading: `exif_keys`, `iptc_keys`, and item access giving tags with a
+`value` and a `raw_value`.
+
+Whenever something is encountered that this reader cannot decode in exactly
+the same way as pyexiv2, it gives up and returns None,
+so that the caller can fall back to pyexiv2.
+"""
+
+import struct
+import hashlib
+from datetime import datetime
+from fractions import Fraction
+
+
+EXIF_TAGS = {
+    0x010E: "Exif.Image.ImageDescription",
+    0x013B: "Exif.Image.Artist",
+    0x8298: "Exif.Image.Copyright",
+    0x0132: "Exif.Image.DateTime",
+    0x9003: "Exif.Image.DateTimeOriginal",
+}
+GPS_POINTER = 0x8825
+GPS_TAGS = {
+    0x0001: "Exif.GPSInfo.GPSLatitudeRef",
+    0x0002: "Exif.GPSInfo.GPSLatitude",
+    0x0003: "Exif.GPSInfo.GPSLongitudeRef",
+    0x0004: "Exif.GPSInfo.GPSLongitude",
+    0x0005: "Exif.GPSInfo.GPSAltitudeRef",
+    0x0006: "Exif.GPSInfo.GPSAltitude",
+}
+IPTC_TAGS = {
+    115: "Iptc.Application2.Source",
+    110: "Iptc.Application2.Credit",
+    116: "Iptc.Application2.Copyright",
+    80: "Iptc.Application2.Byline",
+    122: "Iptc.Application2.Writer",
+    120: "Iptc.Application2.Caption",
+    25: "Iptc.Application2.Keywords",
+}
+
+ASCII = 2
+BYTE = 1
+RATIONAL = 5
+LONG = 4
+TYPE_SIZE = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+
+# pyexiv2 turns ascii values that look like dates into datetime objects
+DATETIME_FORMATS = ("%Y:%m:%d %H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%SZ")
+
+SOI = b"\xff\xd8"
+APP1 = 0xE1
+APP13 = 0xED
+SOS = 0xDA
+EOI = 0xD9
+EXIF_HEADER = b"Exif\x00\x00"
+PHOTOSHOP_HEADER = b"Photoshop 3.0\x00"
+IPTC_RESOURCE = 0x0404
+
+
+class Undecodable(Exception):
+    pass
+
+
+class Tag:
+    def __init__(self, value, raw_value):
+        self.value = value
+        self.raw_value = raw_value
+
+
+class JpegInfo:
+    def __init__(self, exif, iptc):
+        self.exif = exif
+        self.iptc = iptc
+
+    @property
+    def exif_keys(self):
+        return list(self.exif)
+
+    @property
+    def iptc_keys(self):
+        return list(self.iptc)
+
+    def __getitem__(self, key):
+        tags = self.exif if key.startswith("Exif.") else self.iptc
+        return tags[key]
+
+
+def readJpegInfo(path):
+    """Read the EXIF and IPTC metadata of a JPEG file, up to the image data.
+
+    Returns a JpegInfo object, or None if the file cannot be decoded here.
+
+    >>> import tempfile
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> path = f"{tmp.name}/photo.jpg"
+    >>> exif = EXIF_HEADER + struct.pack("<2sHLH", b"II", 42, 8, 0)
+    >>> app1 = struct.pack(">HH", 0xFF00 | APP1, 2 + len(exif)) + exif
+    >>> jpeg = SOI + app1 + struct.pack(">BB", 0xFF, SOS) + b"pixels"
+    >>> with open(path, "wb") as fh:
+    ...     _ = fh.write(jpeg)
+    >>> info = readJpegInfo(path)
+    >>> (info.exif_keys, info.iptc_keys)
+    ([], [])
+    >>> with open(path, "wb") as fh:
+    ...     _ = fh.write(jpeg[0:10])
+    >>> readJpegInfo(path) is None
+    True
+    >>> with open(path, "wb") as fh:
+    ...     _ = fh.write(b"GIF89a")
+    >>> readJpegInfo(path) is None
+    True
+    >>> tmp.cleanup()
+    """
+    try:
+        (exifData, iptcData) = readSegments(path)
+        exif = {} if exifData is None else decodeExif(exifData)
+        iptc = {} if iptcData is None else decodeIptc(iptcData)
+    except (Undecodable, struct.error, UnicodeDecodeError, ZeroDivisionError):
+        return None
+    return JpegInfo(exif, iptc)
+
+
+def readSegments(path):
+    exifData = None
+    iptcData = None
+
+    with open(path, "rb") as fh:
+        if fh.read(2) != SOI:
+            raise Undecodable("not a jpeg file")
+
+        while True:
+            head = fh.read(2)
+            if len(head) < 2 or head[0] != 0xFF:
+                raise Undecodable("no marker where expected")
+            marker = head[1]
+            if marker == 0xFF:
+                fh.seek(-1, 1)
+                continue
+            if marker in {SOS, EOI}:
+                break
+            if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+                continue
+
+            (length,) = struct.unpack(">H", fh.read(2))
+            if length < 2:
+                raise Undecodable("wrong segment length")
+
+            if marker == APP1:
+                data = fh.read(length - 2)
+                if data.startswith(EXIF_HEADER):
+                    if exifData is not None:
+                        raise Undecodable("more than one exif segment")
+                    exifData = data[len(EXIF_HEADER) :]
+            elif marker == APP13:
+                data = fh.read(length - 2)
+                if data.startswith(PHOTOSHOP_HEADER):
+                    if iptcData is not None:
+                        raise Undecodable("more than one photoshop segment")
+                    iptcData = photoshopIptc(data[len(PHOTOSHOP_HEADER) :])
+            else:
+                fh.seek(length - 2, 1)
+
+    return (exifData, iptcData)
+
+
+def segmentDigest(path):
+    """Digest of the metadata segments (APP1 and APP13) of a JPEG file.
+
+    Returns None if the segments cannot be scanned.
+    """
+    return partDigest(path, True)
+
+
+def imageDigest(path):
+    """Digest of all of a JPEG file except its metadata segments.
+
+    It changes if the pixels change, but not if only the metadata changes.
+    Returns None if the segments cannot be scanned.
+    """
+    return partDigest(path, False)
+
+
+def partDigest(path, metadata):
+    """Digest of the metadata segments of a JPEG file, or of all the rest.
+
+    Returns None if the segments cannot be scanned.
+
+    >>> import tempfile
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> path = f"{tmp.name}/photo.jpg"
+    >>> def write(exif, pixels):
+    ...     app1 = struct.pack(">HH", 0xFF00 | APP1, 2 + len(exif)) + exif
+    ...     with open(path, "wb") as fh:
+    ...         _ = fh.write(SOI + app1 + struct.pack(">BB", 0xFF, SOS) + pixels)
+    >>> write(b"Exif", b"pixels")
+    >>> (meta, image) = (partDigest(path, True), partDigest(path, False))
+    >>> write(b"Exif", b"other pixels")
+    >>> (partDigest(path, True) == meta, partDigest(path, False) == image)
+    (True, False)
+    >>> write(b"Exif edited", b"pixels")
+    >>> (partDigest(path, True) == meta, partDigest(path, False) == image)
+    (False, True)
+    >>> with open(path, "r+b") as fh:
+    ...     _ = fh.truncate(7)
+    >>> (partDigest(path, True), partDigest(path, False))
+    (None, None)
+    >>> tmp.cleanup()
+    """
+    digest = hashlib.sha1()
+
+    with open(path, "rb") as fh:
+        if fh.read(2) != SOI:
+            return None
+
+        while True:
+            head = fh.read(2)
+            if len(head) < 2 or head[0] != 0xFF:
+                return None
+            marker = head[1]
+            if marker == 0xFF:
+                fh.seek(-1, 1)
+                continue
+            if marker in {SOS, EOI}:
+                if not metadata:
+                    digest.update(head)
+                    while chunk := fh.read(1 << 20):
+                        digest.update(chunk)
+                break
+            if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+                continue
+
+            lengthBytes = fh.read(2)
+            if len(lengthBytes) < 2:
+                return None
+            (length,) = struct.unpack(">H", lengthBytes)
+            if length < 2:
+                return None
+
+            if (marker in {APP1, APP13}) == metadata:
+                digest.update(head + lengthBytes)
+                digest.update(fh.read(length - 2))
+            else:
+                fh.seek(length - 2, 1)
+
+    return digest.hexdigest()
+
+
+def photoshopIptc(data):
+    """The IPTC data among the Photoshop resources in `data`, or None.
+
+    >>> iptc = struct.pack(">4sHBxL", b"8BIM", IPTC_RESOURCE, 0, 4) + b"IPTC"
+    >>> other = struct.pack(">4sHBxL", b"8BIM", 0x0425, 0, 3) + b"md5" + bytes(1)
+    >>> photoshopIptc(other + iptc)
+    b'IPTC'
+    >>> photoshopIptc(other) is None
+    True
+    >>> photoshopIptc(other + iptc[0:-1])
+    Traceback (most recent call last):
+    ...
+    updatr.jpegmeta.Undecodable: truncated photoshop resource
+    """
+    iptcData = None
+    pos = 0
+    end = len(data)
+
+    while pos + 12 <= end:
+        if data[pos : pos + 4] != b"8BIM":
+            raise Undecodable("wrong photoshop resource")
+        (resourceId, nameLength) = struct.unpack_from(">HB", data, pos + 4)
+        nameSize = nameLength + 1
+        nameSize += nameSize % 2
+        pos += 6 + nameSize
+        (size,) = struct.unpack_from(">L", data, pos)
+        pos += 4
+        if pos + size > end:
+            raise Undecodable("truncated photoshop resource")
+        if resourceId == IPTC_RESOURCE:
+            if iptcData is not None:
+                raise Undecodable("more than one iptc resource")
+            iptcData = data[pos : pos + size]
+        pos += size + size % 2
+
+    return iptcData
+
+
+def decodeExif(data):
+    """The EXIF tags that updatr needs, from the TIFF structure in `data`.
+
+    >>> tiff = struct.pack("<2sHLH", b"II", 42, 8, 2)
+    >>> artist = struct.pack("<HHL4s", 0x013B, ASCII, 4, b"Ann")
+    >>> date = struct.pack("<HHLL", 0x0132, ASCII, 20, 34)
+    >>> exif = decodeExif(tiff + artist + date + b"2020:01:02 03:04:05" + bytes(1))
+    >>> (exif["Exif.Image.Artist"].value, exif["Exif.Image.Artist"].raw_value)
+    ('Ann', 'Ann')
+    >>> exif["Exif.Image.DateTime"].value
+    datetime.datetime(2020, 1, 2, 3, 4, 5)
+    >>> decodeExif(tiff + artist + date + b"2020:01")
+    Traceback (most recent call last):
+    ...
+    updatr.jpegmeta.Undecodable: truncated exif value
+    """
+    order = data[0:2]
+    if order == b"II":
+        bo = "<"
+    elif order == b"MM":
+        bo = ">"
+    else:
+        raise Undecodable("wrong byte order")
+
+    (magic, ifdOffset) = struct.unpack_from(f"{bo}HL", data, 2)
+    if magic != 42:
+        raise Undecodable("wrong tiff header")
+
+    exif = {}
+    entries = readIfd(data, bo, ifdOffset, set(EXIF_TAGS) | {GPS_POINTER})
+
+    for (tag, key) in EXIF_TAGS.items():
+        if tag in entries:
+            exif[key] = asciiTag(entries[tag])
+
+    if GPS_POINTER in entries:
+        (tp, count, raw) = entries[GPS_POINTER]
+        if count != 1 or tp != LONG:
+            raise Undecodable("wrong gps pointer")
+        (gpsOffset,) = struct.unpack(f"{bo}L", raw)
+        gpsEntries = readIfd(data, bo, gpsOffset, set(GPS_TAGS))
+
+        for (tag, key) in GPS_TAGS.items():
+            if tag not in gpsEntries:
+                continue
+            entry = gpsEntries[tag]
+            tp = entry[0]
+            if tp == ASCII:
+                exif[key] = asciiTag(entry)
+            elif tp == RATIONAL:
+                exif[key] = rationalTag(entry, bo)
+            elif tp == BYTE:
+                exif[key] = byteTag(entry)
+            else:
+                raise Undecodable("unexpected gps type")
+
+    return exif
+
+
+def readIfd(data, bo, offset, wanted):
+    (n,) = struct.unpack_from(f"{bo}H", data, offset)
+    entries = {}
+
+    for i in range(n):
+        (tag, tp, count) = struct.unpack_from(f"{bo}HHL", data, offset + 2 + 12 * i)
+        if tag not in wanted:
+            continue
+        if tp not in TYPE_SIZE:
+            raise Undecodable("unknown exif type")
+        size = TYPE_SIZE[tp] * count
+        valuePos = offset + 2 + 12 * i + 8
+        if size > 4:
+            (valuePos,) = struct.unpack_from(f"{bo}L", data, valuePos)
+        raw = data[valuePos : valuePos + size]
+        if len(raw) != size:
+            raise Undecodable("truncated exif value")
+        if tag in entries:
+            raise Undecodable("duplicate exif tag")
+        entries[tag] = (tp, count, raw)
+
+    return entries
+
+
+def asciiTag(entry):
+    (tp, count, raw) = entry
+    if tp != ASCII:
+        raise Undecodable("non ascii string")
+    text = raw.split(b"\x00", 1)
+    if len(text) > 1 and text[1].strip(b"\x00"):
+        raise Undecodable("embedded nul in string")
+    text = text[0].decode("utf-8")
+
+    for format in DATETIME_FORMATS:
+        try:
+            value = datetime.strptime(text, format)
+        except ValueError:
+            continue
+        else:
+            return Tag(value, text)
+
+    return Tag(text, text)
+
+
+def rationalTag(entry, bo):
+    (tp, count, raw) = entry
+    numbers = struct.unpack(f"{bo}{2 * count}L", raw)
+    pairs = list(zip(numbers[0::2], numbers[1::2]))
+    rawValue = " ".join(f"{n}/{d}" for (n, d) in pairs)
+    values = [Fraction(n, d) for (n, d) in pairs]
+    return Tag(values if count > 1 else values[0], rawValue)
+
+
+def byteTag(entry):
+    (tp, count, raw) = entry
+    if count != 1:
+        raise Undecodable("multiple bytes")
+    text = str(raw[0])
+    return Tag(text, text)
+
+
+def decodeIptc(data):
+    """The IPTC datasets that updatr needs, from the IPTC data in `data`.
+
+    >>> def dataset(number, text):
+    ...     value = text.encode("utf-8")
+    ...     return struct.pack(">BBBH", 0x1C, 2, number, len(value)) + value
+    >>> keywords = dataset(25, "zee") + dataset(25, "duin")
+    >>> iptc = decodeIptc(keywords + dataset(120, "Café"))
+    >>> iptc["Iptc.Application2.Keywords"].value
+    ['zee', 'duin']
+    >>> iptc["Iptc.Application2.Caption"].value
+    ['Café']
+    >>> decodeIptc(dataset(120, "Café")[0:-1])
+    Traceback (most recent call last):
+    ...
+    updatr.jpegmeta.Undecodable: truncated iptc dataset
+    """
+    iptc = {}
+    pos = 0
+    end = len(data)
+
+    while pos < end:
+        if data[pos] == 0:
+            # padding at the end of the resource
+            if data[pos:].strip(b"\x00"):
+                raise Undecodable("garbage after iptc data")
+            break
+        if data[pos] != 0x1C or pos + 5 > end:
+            raise Undecodable("wrong iptc dataset")
+        (record, dataset, size) = struct.unpack_from(">BBH", data, pos + 1)
+        if size & 0x8000:
+            raise Undecodable("extended iptc dataset")
+        pos += 5
+        value = data[pos : pos + size]
+        if len(value) != size:
+            raise Undecodable("truncated iptc dataset")
+        pos += size
+
+        if record != 2 or dataset not in IPTC_TAGS:
+            continue
+        if b"\x00" in value:
+            raise Undecodable("nul in iptc string")
+        iptc.setdefault(IPTC_TAGS[dataset], []).append(value.decode("utf-8"))
+
+    return {key: Tag(values, values) for (key, values) in iptc.items()}
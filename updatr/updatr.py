@@ -2,8 +2,16 @@ import re
 import os
 import sys
 import urllib
+import json
+import queue
+import sqlite3
+import hashlib
 from datetime import datetime
-from time import sleep
+import threading
+import functools
+from contextlib import contextmanager
+from time import sleep, perf_counter, monotonic
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import fractions
 from math import modf
 import yaml
@@ -14,6 +22,8 @@ import pprint
 import pyexiv2
 import flickrapi
 
+from .jpegmeta import readJpegInfo, segmentDigest, imageDigest
+
 
 pp = pprint.PrettyPrinter(indent=2)
 
@@ -30,13 +40,18 @@ COMMANDS = dict(
     exportmetafull="""
     export full metadata from photos to the dropbox directory,
     Full means: with default values and computed values.
-    Only when the photo is newer than the metadata file.
+    Only photos whose metadata has changed since their last export.
     But when force, do all photos.
 """,
     sync="""
     sync updates to Flickr, including metadata and album membership;
     if force, sync all photos".
     Also export metadata of changed photos in full.
+""",
+    plan="""
+    show what sync would do, with an estimate of the calls to Flickr,
+    the bytes to upload and the time it takes; change nothing.
+    if force, plan for all photos.
 """,
     albumsort="""
     sort existing albums on Flickr; do not sync metadata and album changes.
@@ -45,27 +60,148 @@ COMMANDS = dict(
     albumsync="""
     sync album memberships to Flickr, do not sync metadata changes.
     You can pass a comma-separated list of albums to sync.
+""",
+    checkmeta="""
+    read the metadata of the photos with the fast reader and with pyexiv2,
+    and report the photos where they differ.
+""",
+    convertmeta="""
+    convert the metadata directories to the layout passed as flag:
+    `files`  : a yaml file per photo in a directory;
+    `stream` : a single json lines file per directory.
+    Then set `metaLayout` in config.yaml accordingly.
 """,
 )
+
+# the flags that each command accepts; None means: any value
+FLAGS = dict(
+    importmeta={"force"},
+    exportmeta={"full"},
+    exportmetafull={"force"},
+    sync={"force"},
+    plan={"force"},
+    albumsort=None,
+    albumsync=None,
+    checkmeta=set(),
+    convertmeta={"files", "stream"},
+)
+# the commands that can be run with --dry-run
+DRY_RUN = {"plan", "sync", "albumsync", "albumsort"}
 COMMAND_STR = "\n".join(f"{k:<10} : {v}" for (k, v) in sorted(COMMANDS.items()))
 
+POOLS = dict(thread=ThreadPoolExecutor, process=ProcessPoolExecutor)
+
+
+def poolKind(value):
+    if value not in POOLS:
+        raise ValueError(value)
+    return value
+
+
+def positiveInt(value):
+    value = int(value)
+    if value < 1:
+        raise ValueError(value)
+    return value
+
+
+OPTIONS = {
+    "exiv2": (
+        None,
+        None,
+        """
+    read metadata from photos with pyexiv2 only, not with the fast reader.
+""",
+    ),
+    "jobs": (
+        "N",
+        positiveInt,
+        """
+    number of workers for importmeta, exportmeta, exportmetafull and sync;
+    default 1: no workers.
+""",
+    ),
+    "uploads": (
+        "N",
+        positiveInt,
+        """
+    number of photos that sync uploads to Flickr at the same time; default 1.
+""",
+    ),
+    "pool": (
+        "KIND",
+        poolKind,
+        """
+    kind of workers for exportmeta and exportmetafull: `thread` or `process`;
+    default `thread`. importmeta always uses processes.
+""",
+    ),
+    "bulk": (
+        None,
+        None,
+        """
+    get the titles and dates of the photos on Flickr from a single listing of
+    the whole account, instead of album by album.
+""",
+    ),
+    "local-dates": (
+        None,
+        None,
+        """
+    let albumsort use the dates of the photos as known locally,
+    instead of fetching them from Flickr.
+""",
+    ),
+    "refresh-remote": (
+        None,
+        None,
+        """
+    fetch all albums and photos from Flickr, not only what has changed since
+    the previous run.
+""",
+    ),
+    "dry-run": (
+        None,
+        None,
+        """
+    let sync, albumsync and albumsort only show what they would change,
+    with an estimate of the costs, without changing anything.
+""",
+    ),
+    "profile": (
+        "FILE",
+        str,
+        """
+    write a report of the run to FILE, in json: the time spent in each phase,
+    and the calls to Flickr per method, with their latencies and uploaded bytes.
+""",
+    ),
+}
+OPTION_STR = "\n".join(
+    f"--{k}{'' if arg is None else f' {arg}'} : {v}"
+    for (k, (arg, tp, v)) in sorted(OPTIONS.items())
+)
+
 IMAGE_BASE = os.path.expanduser("~/Dropbox")
 # IMAGE_BASE = os.path.expanduser("~/DropboxTest")
 
 HELP = f"""
-updatr source[:name] [command] [flag]
+updatr source[:name] [command] [flag] [--option [value]] ...
 
 source: a directory name with a photo collection, residing under {IMAGE_BASE}
 name  : the name of a photo in the source directory.
         If present, work only with this photo.
-        In that case, the force flag will be set and the datestamp
-        of the Flickr update will be ignored and not updated.
+        In that case, the force flag will be set; what is pushed
+        to Flickr is recorded for this photo, as in a full sync.
 
 command flag:
 {COMMAND_STR}
 
 If no command is given, `sync` is assumed.
 
+options:
+{OPTION_STR}
+
 -h
 --help
 help  : print help and exit
@@ -76,6 +212,11 @@ REPO_DIR = f"{os.path.dirname(os.path.dirname(os.path.abspath(__file__)))}"
 LOCAL_DIR = f"{REPO_DIR}/_local"
 FLICKR_CONFIG = f"{LOCAL_DIR}/flickr.yaml"
 FLICKR_UPDATED_FILE = "flickrupdated.txt"
+INDEX_FILE = "index.sqlite"
+INDEX_VERSION = 1
+SNAPSHOT_FILE = "flickr.json"
+JOURNAL_FILE = "journal.jsonl"
+PLAN_FILE = "plan.json"
 
 
 METADATA = (
@@ -89,9 +230,11 @@ METADATA = (
     ("datetime", None, "Exif.Image.DateTime"),
     ("location", None, None),
 )
-EXIF_DATE = METADATA[-1][-1]
 GPS = "Exif.GPSInfo.GPS"
 
+# metadata fields that can be set on Flickr without uploading the photo file
+FLICKR_FIELDS = ("caption", "keywords", "location", "datetime")
+
 CAPTION_SEP = "\n---\n"
 COLOFON_RE = re.compile(
     r"""(?:(?:\s*\(Bron:\s*)|(?:{})).*$""".format(CAPTION_SEP), re.S
@@ -99,6 +242,31 @@ COLOFON_RE = re.compile(
 
 CACHE = False
 
+# Flickr allows 3600 calls per hour per API key
+RATE_LIMIT = dict(callsPerHour=3600, burst=10, maxBackoff=300, retries=6)
+RATE_LIMITED_RE = re.compile(r"Status code (?:429|503) received")
+# Flickr error "Service currently unavailable": what the API says instead of 503
+SERVICE_UNAVAILABLE = 105
+# assumed upload speed in bytes per second, for estimating the time of a plan
+UPLOAD_SPEED = 1_000_000
+# the upper bounds in seconds of the latency buckets in a profile
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# the maximum number of photos that Flickr gives per page
+PER_PAGE = 500
+# editing albums: at most MAX_IDS photo ids go in one call,
+# and sending IDS_COST photo ids costs as much as one call more
+MAX_IDS = 1000
+IDS_COST = 200
+# what the listing of the whole account gives of each photo
+ACCOUNT_EXTRAS = "date_taken"
+
+# photos that may wait between two stages of the sync pipeline
+QUEUE_SIZE = 16
+
+# libyaml based loader and dumper, if pyyaml has been built with it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
 
 def console(*args, error=False):
     device = sys.stderr if error else sys.stdout
@@ -124,7 +292,9 @@ def readArgs():
     A.source = None
     A.command = None
 
-    args = sys.argv[1:]
+    args = readOptions(A, sys.argv[1:])
+    if args is None:
+        return None
 
     if not len(args):
         console(HELP)
@@ -158,51 +328,423 @@ def readArgs():
     args = args[1:]
     flag = None
 
+    if command not in COMMANDS:
+        console(HELP)
+        console(f"Wrong command: «{' '.join(args)}»")
+        return None
+
+    flags = FLAGS[command]
+
     if args:
         flag = args[0]
-        if (
-            flag == "full"
-            and command != "exportmeta"
-            or flag == "force"
-            and command not in {"importmeta", "exportmetafull", "sync"}
-            or flag not in {"full", "force"}
-        ):
+        if flags is not None and flag not in flags:
             console(HELP)
             console(f"Unknown flag `{flag}` for command `{command}`")
             return None
+    elif command == "convertmeta":
+        console(HELP)
+        console(f"Missing flag for command `{command}`")
+        return None
 
-    A.flag = flag
-
-    if command not in COMMANDS:
+    if A.options.get("dry-run", False) and command not in DRY_RUN:
         console(HELP)
-        console(f"Wrong command: «{' '.join(args)}»")
+        console(f"Option `--dry-run` does not work with command `{command}`")
         return None
 
+    A.flag = flag
+
     return A
 
 
+def readOptions(A, args):
+    options = {}
+    A.options = options
+    rest = []
+
+    args = list(args)
+
+    while args:
+        arg = args.pop(0)
+        if not arg.startswith("--") or arg == "--help":
+            rest.append(arg)
+            continue
+
+        (option, hasValue, value) = arg[2:].partition("=")
+        if option not in OPTIONS:
+            console(HELP)
+            console(f"Unknown option `{arg}`")
+            return None
+
+        (_, tp, _) = OPTIONS[option]
+        if tp is None:
+            options[option] = True
+            continue
+
+        if not hasValue:
+            if not args:
+                console(HELP)
+                console(f"Missing value for option `{arg}`")
+                return None
+            value = args.pop(0)
+        try:
+            options[option] = tp(value)
+        except ValueError:
+            console(HELP)
+            console(f"Wrong value `{value}` for option `--{option}`")
+            return None
+
+    return rest
+
+
 def readYaml(path):
     with open(path) as fh:
-        settings = yaml.load(fh, Loader=yaml.FullLoader)
+        settings = yaml.load(fh, Loader=YAML_LOADER)
     return settings
 
 
-def getPhotoDate(inPath):
-    info = pyexiv2.ImageMetadata(inPath)
-    info.read()
-    eNames = set(info.exif_keys)
-    eName = EXIF_DATE
-    eNameOrig = f"{eName}Original"
-    val = "" if eNameOrig not in eNames else info[eNameOrig].raw_value
-    if not val:
-        val = "" if eName not in eNames else info[eName].raw_value
-    return val
+def writeYaml(data, fh):
+    yaml.dump(data, fh, Dumper=YAML_DUMPER, allow_unicode=True)
 
 
-def getPhotoMeta(inPath, defaults, expanded):
-    info = pyexiv2.ImageMetadata(inPath)
-    info.read()
-    metadata = {}
+def recordDigest(record):
+    text = json.dumps(record, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(text.encode("utf8")).hexdigest()
+
+
+def yamlDigest(path):
+    return recordDigest(readYaml(path))
+
+
+def fileStamp(path):
+    if not os.path.exists(path):
+        return "-"
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def fileDigest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as fh:
+        while chunk := fh.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def metaDigest(path):
+    digest = segmentDigest(path)
+    return fileDigest(path) if digest is None else digest
+
+
+def pixelDigest(path):
+    digest = imageDigest(path)
+    return fileDigest(path) if digest is None else digest
+
+
+def pushDigests(metadata, pixels):
+    """Digests of the parts of a photo as they are pushed to Flickr.
+
+    The fields in FLICKR_FIELDS have a digest each.
+    The pixels and the other metadata fields can only reach Flickr by
+    uploading the photo file, they have a digest together.
+    """
+    fileFields = {k: v for (k, v) in metadata.items() if k not in FLICKR_FIELDS}
+    digests = dict(file=recordDigest([pixels, fileFields]))
+    for field in FLICKR_FIELDS:
+        digests[field] = recordDigest(metadata.get(field, ""))
+    return digests
+
+
+class FileStore:
+    """Metadata records of photos as a directory with a yaml file per photo."""
+
+    layout = "files"
+
+    def __init__(self, path):
+        self.path = path
+
+    def filePath(self, name):
+        return f"{self.path}/{name}.yaml"
+
+    def names(self):
+        if not os.path.exists(self.path):
+            return []
+        return sorted(
+            fName.removesuffix(".yaml")
+            for fName in os.listdir(self.path)
+            if fName.endswith(".yaml") and not fName.startswith(".")
+        )
+
+    def get(self, name):
+        path = self.filePath(name)
+        return readYaml(path) if os.path.exists(path) else None
+
+    def put(self, name, record):
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.filePath(name), "w") as exh:
+            writeYaml(record, exh)
+        return True
+
+    def flush(self):
+        pass
+
+    def remove(self):
+        for name in self.names():
+            os.remove(self.filePath(name))
+        if os.path.exists(self.path) and not os.listdir(self.path):
+            os.rmdir(self.path)
+
+
+class StreamStore:
+    """Metadata records of photos as a single json lines file.
+
+    The file sits next to where the directory of the `files` layout would be,
+    and has a line with the name and the metadata for each photo.
+    It is read in one pass when needed, and written in one pass when it
+    has changed.
+    """
+
+    layout = "stream"
+
+    def __init__(self, path):
+        self.path = f"{path}.jsonl"
+        self.records = None
+        self.dirty = False
+
+    def load(self):
+        if self.records is None:
+            records = {}
+            if os.path.exists(self.path):
+                with open(self.path, encoding="utf8") as fh:
+                    for line in fh:
+                        if line.strip():
+                            record = json.loads(line)
+                            records[record["name"]] = record["meta"]
+            self.records = records
+        return self.records
+
+    def names(self):
+        return sorted(self.load())
+
+    def get(self, name):
+        return self.load().get(name, None)
+
+    def put(self, name, record):
+        records = self.load()
+        if records.get(name, None) == record:
+            return False
+        records[name] = record
+        self.dirty = True
+        return True
+
+    def flush(self):
+        if not self.dirty:
+            return
+
+        records = self.records
+        tmpPath = f"{self.path}.tmp"
+
+        with open(tmpPath, "w", encoding="utf8") as fh:
+            for name in sorted(records):
+                record = dict(name=name, meta=records[name])
+                fh.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+        os.replace(tmpPath, self.path)
+        self.dirty = False
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.records = None
+        self.dirty = False
+
+
+STORES = dict(files=FileStore, stream=StreamStore)
+
+
+class SyncJournal:
+    """What a sync has done on Flickr so far, so that it can be resumed.
+
+    Every photo that has been put on Flickr, and every album that has been
+    edited, is appended to the journal as a line of json, and written to disk
+    at once.
+    If a sync is interrupted, its journal stays behind, and the next sync
+    skips the photos and album edits that are in it.
+    A sync that runs to the end removes the journal.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.photos = {}
+        self.albums = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, encoding="utf8") as fh:
+                for line in fh:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line may be incomplete
+                        continue
+                    if "photo" in entry:
+                        self.photos[entry["photo"]] = entry
+                    elif "album" in entry:
+                        self.albums[entry["album"]] = entry
+
+        self.fh = open(path, "a", encoding="utf8")
+
+    def resumed(self):
+        return bool(self.photos or self.albums)
+
+    def getPhoto(self, name, digest):
+        """The entry of a photo, if it has been put on Flickr as it is now."""
+        entry = self.photos.get(name, None)
+        return None if entry is None or entry["file"] != digest else entry
+
+    def putPhoto(self, name, photoId, digest, pushed):
+        self.write(dict(photo=name, id=photoId, file=digest, pushed=pushed))
+
+    def hasAlbum(self, albumId, primary, photoIds):
+        entry = self.albums.get(albumId, None)
+        return (
+            entry is not None
+            and entry["primary"] == primary
+            and entry["photos"] == photoIds
+        )
+
+    def putAlbum(self, albumId, primary, photoIds):
+        self.write(dict(album=albumId, primary=primary, photos=photoIds))
+
+    def write(self, entry):
+        fh = self.fh
+        with self.lock:
+            fh.write(f"{json.dumps(entry, ensure_ascii=False)}\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    def close(self):
+        self.fh.close()
+
+    def remove(self):
+        self.close()
+        os.unlink(self.path)
+
+
+class FlickrSnapshot:
+    """What is known locally of the albums on Flickr and the photos in them.
+
+    For every album: its title, its `date_update` on Flickr when its photos
+    were fetched, and the ids of its photos in the order of Flickr.
+    For every photo in those albums: its title.
+
+    Only albums whose `date_update` has changed need to be fetched again,
+    and only the titles of photos that Flickr reports as updated since the
+    previous refresh.
+    Changes that updatr makes itself are recorded here as well,
+    with an unknown `date_update`, which is filled in later.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.albums = {}
+        self.titles = {}
+        self.updated = None
+        self.dirty = False
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf8") as fh:
+                data = json.load(fh)
+            self.albums = data["albums"]
+            self.titles = data["titles"]
+            self.updated = data["updated"]
+
+    def getAlbum(self, albumId, dateUpdate, size):
+        """The photos of an album, or None if they may have changed on Flickr."""
+        album = self.albums.get(albumId, None)
+        if (
+            album is None
+            or album["dateUpdate"] is None
+            or album["dateUpdate"] != dateUpdate
+            or len(album["photos"]) != size
+        ):
+            return None
+
+        titles = self.titles
+        if any(photoId not in titles for photoId in album["photos"]):
+            return None
+        return [dict(id=photoId, title=titles[photoId]) for photoId in album["photos"]]
+
+    def putAlbum(self, albumId, title, dateUpdate, photos):
+        titles = self.titles
+        self.albums[albumId] = dict(
+            title=title,
+            dateUpdate=dateUpdate,
+            photos=[photo["id"] for photo in photos],
+        )
+        for photo in photos:
+            titles[photo["id"]] = photo["title"]
+        self.dirty = True
+
+    def setPhotos(self, albumId, title, photoIds):
+        self.albums[albumId] = dict(title=title, dateUpdate=None, photos=photoIds)
+        self.dirty = True
+
+    def setTitles(self, photos):
+        titles = self.titles
+        for photo in photos:
+            photoId = photo["id"]
+            if photoId in titles and titles[photoId] != photo["title"]:
+                titles[photoId] = photo["title"]
+                self.dirty = True
+
+    def setDates(self, allAlbums):
+        for album in allAlbums:
+            known = self.albums.get(album["id"], None)
+            if known is not None and known["dateUpdate"] is None:
+                known["dateUpdate"] = album["date_update"]
+                self.dirty = True
+
+    def keep(self, albumIds):
+        albums = self.albums
+        for albumId in set(albums) - set(albumIds):
+            del albums[albumId]
+            self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        albums = self.albums
+        inAlbums = {photoId for album in albums.values() for photoId in album["photos"]}
+        titles = {
+            photoId: title
+            for (photoId, title) in self.titles.items()
+            if photoId in inAlbums
+        }
+        data = dict(updated=self.updated, albums=albums, titles=titles)
+        tmpPath = f"{self.path}.tmp"
+
+        with open(tmpPath, "w", encoding="utf8") as fh:
+            json.dump(data, fh, ensure_ascii=False)
+
+        os.replace(tmpPath, self.path)
+        self.dirty = False
+
+
+def readPhotoInfo(inPath, fast=True):
+    info = readJpegInfo(inPath) if fast else None
+    if info is None:
+        info = pyexiv2.ImageMetadata(inPath)
+        info.read()
+    return info
+
+
+def readPhotoMeta(inPath, fast=True):
+    return extractMeta(readPhotoInfo(inPath, fast=fast))
+
+
+def extractMeta(info):
     eNames = set(info.exif_keys)
     iNames = set(info.iptc_keys)
 
@@ -223,10 +765,23 @@ def getPhotoMeta(inPath, defaults, expanded):
             iVal = "\n".join(iVal)
             eVal = "" if eName not in eNames else info[eName].value
             val = eVal if not iVal or eVal and len(eVal) > len(iVal) else iVal
-            if not expanded and log == "caption":
-                val = COLOFON_RE.sub("", val)
         actual[log] = val
 
+    return actual
+
+
+def getPhotoMeta(inPath, defaults, expanded, index=None, fast=True):
+    actual = readPhotoMeta(inPath, fast=fast) if index is None else index.get(inPath)
+    return logicalMeta(actual, defaults, expanded)
+
+
+def logicalMeta(actual, defaults, expanded):
+    actual = dict(actual)
+    metadata = {}
+
+    if not expanded:
+        actual["caption"] = COLOFON_RE.sub("", actual["caption"])
+
     actual["sourceAsUrl"] = urllib.parse.quote_plus(actual["source"])
 
     for (log, iName, eName) in METADATA:
@@ -249,6 +804,427 @@ def getPhotoMeta(inPath, defaults, expanded):
     return metadata
 
 
+def exportMeta(inPath, outPath, defaults, expanded, actual, fast):
+    """Write the metadata of a photo to a yaml file.
+
+    This runs in workers, so it gets everything it needs as arguments.
+    If the metadata has not been read from the photo yet, `actual` is None.
+    If `outPath` is None, nothing is written.
+    Returns the metadata as read from the photo, so that it can be indexed,
+    and the metadata as exported.
+    """
+    if actual is None:
+        actual = readPhotoMeta(inPath, fast=fast)
+
+    metadata = logicalMeta(actual, defaults, expanded)
+
+    if outPath is not None:
+        with open(outPath, "w") as exh:
+            writeYaml(metadata, exh)
+
+    return (actual, metadata)
+
+
+class MetaIndex:
+    """Persistent index of the metadata that has been read from photos.
+
+    Entries are keyed by the path of the photo, and remember the size and
+    modification time of the file when it was read.
+    A photo is only read again if its file has changed since then.
+
+    The index can be used from several threads at the same time.
+    """
+
+    def __init__(self, path, fast=True):
+        self.fast = fast
+        self.lock = threading.RLock()
+        db = sqlite3.connect(path, check_same_thread=False)
+        (version,) = db.execute("pragma user_version").fetchone()
+        if version != INDEX_VERSION:
+            db.execute("drop table if exists photo")
+            db.execute(f"pragma user_version = {INDEX_VERSION}")
+        db.execute(
+            """
+            create table if not exists photo (
+                path text primary key,
+                size integer,
+                mtime integer,
+                meta text
+            )
+            """
+        )
+        db.execute(
+            """
+            create table if not exists digest (
+                path text,
+                kind text,
+                size integer,
+                mtime integer,
+                digest text,
+                primary key (path, kind)
+            )
+            """
+        )
+        db.execute(
+            """
+            create table if not exists state (
+                kind text,
+                name text,
+                digest text,
+                primary key (kind, name)
+            )
+            """
+        )
+        db.execute(
+            """
+            create table if not exists flickr (
+                name text primary key,
+                photoId text,
+                size integer,
+                mtime integer,
+                file text,
+                pushed text,
+                updated text
+            )
+            """
+        )
+        db.execute(
+            """
+            create table if not exists keyword (
+                keyword text,
+                name text,
+                primary key (keyword, name)
+            )
+            """
+        )
+        db.execute("create index if not exists keywordName on keyword (name)")
+        db.execute(
+            """
+            create table if not exists keywordstamp (
+                name text primary key,
+                signature text
+            )
+            """
+        )
+        db.execute(
+            """
+            create table if not exists date (
+                name text primary key,
+                signature text,
+                datetime text
+            )
+            """
+        )
+        self.db = db
+
+    def lookup(self, inPath, stat):
+        with self.lock:
+            row = self.db.execute(
+                "select size, mtime, meta from photo where path = ?", (inPath,)
+            ).fetchone()
+        if row is None:
+            return None
+        (size, mtime, meta) = row
+        if size != stat.st_size or mtime != stat.st_mtime_ns:
+            return None
+        return json.loads(meta)
+
+    def store(self, inPath, stat, actual):
+        with self.lock:
+            self.db.execute(
+                """
+                insert or replace into photo (path, size, mtime, meta)
+                values (?, ?, ?, ?)
+                """,
+                (inPath, stat.st_size, stat.st_mtime_ns, json.dumps(actual)),
+            )
+
+    def get(self, inPath):
+        stat = os.stat(inPath)
+        actual = self.lookup(inPath, stat)
+        if actual is None:
+            actual = readPhotoMeta(inPath, fast=self.fast)
+            self.store(inPath, stat, actual)
+        return actual
+
+    def digest(self, path, kind, compute):
+        """Digest of a file, only computed again if the file has changed.
+
+        `kind` tells what is digested, `compute` is the function that does it.
+        """
+        stat = os.stat(path)
+        db = self.db
+        with self.lock:
+            row = db.execute(
+                "select size, mtime, digest from digest where path = ? and kind = ?",
+                (path, kind),
+            ).fetchone()
+        if row is not None:
+            (size, mtime, digest) = row
+            if size == stat.st_size and mtime == stat.st_mtime_ns:
+                return digest
+
+        digest = compute(path)
+        with self.lock:
+            db.execute(
+                """
+                insert or replace into digest (path, kind, size, mtime, digest)
+                values (?, ?, ?, ?, ?)
+                """,
+                (path, kind, stat.st_size, stat.st_mtime_ns, digest),
+            )
+        return digest
+
+    def getState(self, kind, name):
+        with self.lock:
+            row = self.db.execute(
+                "select digest from state where kind = ? and name = ?", (kind, name)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def setState(self, kind, name, digest):
+        with self.lock:
+            self.db.execute(
+                "insert or replace into state (kind, name, digest) values (?, ?, ?)",
+                (kind, name, digest),
+            )
+
+    def getPushed(self, name=None):
+        """What has last been pushed to Flickr, for a photo or for all photos.
+
+        A record has the Flickr id of the photo, the size, modification time
+        and digest of its file, the digests of its parts as `pushDigests`
+        gives them, and when it was pushed.
+        The digest of the file is None if it is not known,
+        and empty if the last push has failed.
+        """
+        query = "select name, photoId, size, mtime, file, pushed, updated from flickr"
+        with self.lock:
+            if name is None:
+                rows = self.db.execute(query).fetchall()
+            else:
+                rows = self.db.execute(f"{query} where name = ?", (name,)).fetchall()
+
+        records = {
+            name: dict(
+                photoId=photoId,
+                size=size,
+                mtime=mtime,
+                file=file,
+                pushed={} if pushed is None else json.loads(pushed),
+                updated=updated,
+            )
+            for (name, photoId, size, mtime, file, pushed, updated) in rows
+        }
+        return records if name is None else records.get(name, None)
+
+    def setPushed(self, name, photoId, stat, file, pushed):
+        with self.lock:
+            self.db.execute(
+                """
+                insert or replace into flickr
+                (name, photoId, size, mtime, file, pushed, updated)
+                values (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    name,
+                    photoId,
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    file,
+                    None if pushed is None else json.dumps(pushed),
+                    datetime.now().isoformat(timespec="seconds"),
+                ),
+            )
+
+    def setPushedStamp(self, name, stat):
+        with self.lock:
+            self.db.execute(
+                "update flickr set size = ?, mtime = ? where name = ?",
+                (stat.st_size, stat.st_mtime_ns, name),
+            )
+
+    def unsetPushed(self, name):
+        """Let a photo count as changed, but remember what has been pushed of it."""
+        with self.lock:
+            self.db.execute("update flickr set file = '' where name = ?", (name,))
+
+    def getDates(self):
+        with self.lock:
+            return {
+                name: (signature, datetime)
+                for (name, signature, datetime) in self.db.execute(
+                    "select name, signature, datetime from date"
+                )
+            }
+
+    def setDates(self, entries):
+        with self.lock:
+            self.db.executemany(
+                """
+                insert or replace into date (name, signature, datetime)
+                values (?, ?, ?)
+                """,
+                entries,
+            )
+
+    def getKeywords(self):
+        """The keywords in the index: the signatures of the photos they come from,
+        the keywords per photo, and the photos per keyword.
+        """
+        signatures = {}
+        keywordsFromPhoto = {}
+        photosFromKeyword = {}
+
+        with self.lock:
+            for (name, signature) in self.db.execute(
+                "select name, signature from keywordstamp"
+            ):
+                signatures[name] = signature
+                keywordsFromPhoto[name] = set()
+            for (keyword, name) in self.db.execute("select keyword, name from keyword"):
+                keywordsFromPhoto.setdefault(name, set()).add(keyword)
+                photosFromKeyword.setdefault(keyword, set()).add(name)
+
+        return (signatures, keywordsFromPhoto, photosFromKeyword)
+
+    def setKeywords(self, name, signature, keywords):
+        with self.lock:
+            db = self.db
+            db.execute("delete from keyword where name = ?", (name,))
+            db.executemany(
+                "insert or ignore into keyword (keyword, name) values (?, ?)",
+                [(keyword, name) for keyword in keywords],
+            )
+            db.execute(
+                "insert or replace into keywordstamp (name, signature) values (?, ?)",
+                (name, signature),
+            )
+
+    def prune(self, names):
+        """Forget everything about photos that are no longer in the collection.
+
+        Rows keyed by path belong to the photo whose name is the file name
+        of the path without extension: the photo itself or its yaml record.
+        """
+        names = set(names)
+        db = self.db
+
+        def pathName(path):
+            return os.path.splitext(os.path.basename(path))[0]
+
+        with self.lock:
+            for table in ("photo", "digest"):
+                gone = {
+                    (path,)
+                    for (path,) in db.execute(f"select path from {table}")
+                    if pathName(path) not in names
+                }
+                if gone:
+                    db.executemany(f"delete from {table} where path = ?", gone)
+
+            for table in ("state", "flickr", "keyword", "keywordstamp", "date"):
+                gone = {
+                    (name,)
+                    for (name,) in db.execute(f"select name from {table}")
+                    if name not in names
+                }
+                if gone:
+                    db.executemany(f"delete from {table} where name = ?", gone)
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+
+def readRecord(logical, inPath):
+    """Get a metadata record as `applyMeta` gets it, see there."""
+    if logical is not None:
+        logical = dict(logical)
+    elif inPath is not None and os.path.exists(inPath):
+        logical = readYaml(inPath)
+    else:
+        logical = {}
+    sanitize(logical)
+    return logical
+
+
+def recordMeta(logical, defaults, colofon):
+    """The values that applying a metadata record writes into a photo.
+
+    A value of None means that the photo keeps what it has.
+    """
+    actual = {}
+    for (log, iName, eName) in METADATA:
+        if log == "keywords":
+            val = sorted(set(logical.get(log, [])) | set(defaults[log]))
+        else:
+            val = logical.get(log, None)
+            if val is None:
+                val = defaults.get(log, None)
+        actual[log] = val
+
+    if actual.get("source", None) is not None:
+        actual["sourceAsUrl"] = urllib.parse.quote_plus(actual["source"])
+    cpr = actual.get("copyright", None)
+    caption = actual.get("caption", None)
+
+    if cpr is not None:
+        actual["copyright"] = cpr.format(**actual)
+    colofon = colofon.format(**actual)
+
+    if caption is None:
+        actual["caption"] = f"{CAPTION_SEP}{colofon}"
+    else:
+        caption = COLOFON_RE.sub("", caption)
+        actual["caption"] = f"{caption}{CAPTION_SEP}{colofon}"
+
+    return actual
+
+
+def applyMeta(logical, inPath, outPath, defaults, colofon):
+    """Apply a metadata record to a photo.
+
+    The record is passed as `logical`, or, if that is None, read from the yaml
+    file at `inPath`, if there is one.
+
+    This runs in worker processes, so it gets everything it needs as arguments.
+    Returns None once the photo has been written, otherwise the error that
+    prevented reading the record or writing the photo, as text.
+    """
+    try:
+        actual = recordMeta(readRecord(logical, inPath), defaults, colofon)
+
+        info = pyexiv2.ImageMetadata(outPath)
+        info.read()
+
+        for (log, iName, eName) in METADATA:
+            val = actual[log]
+            if val is None:
+                continue
+            if iName is not None:
+                info[iName] = val if log == "keywords" else [val]
+            if eName is not None:
+                info[eName] = val
+            if log == "datetime":
+                info[f"{eName}Original"] = val
+                (date, time) = val.split(" ")
+                date = date.replace(":", "-")
+                val = datetime.fromisoformat(f"{date}T{time}")
+                info["Iptc.Application2.DateCreated"] = [val]
+                info["Iptc.Application2.TimeCreated"] = [val]
+                info["Iptc.Application2.DigitizationDate"] = [val]
+                info["Iptc.Application2.DigitizationTime"] = [val]
+            elif log == "location":
+                putGPS(val, info)
+
+        info.write()
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+    return None
+
+
 class Fraction(fractions.Fraction):
     """Only create Fractions from floats.
 
@@ -314,6 +1290,20 @@ LNG_RE = re.compile(r"lng=(\S*)")
 ALT_RE = re.compile(r"alt=(\S*)")
 
 
+def flickrLocation(val):
+    latitude = LAT_RE.findall(val)
+    longitude = LNG_RE.findall(val)
+    if latitude and latitude[0] and longitude and longitude[0]:
+        return (latitude[0], longitude[0])
+    return None
+
+
+def flickrDate(val):
+    (date, time) = val.split(" ")
+    date = date.replace(":", "-")
+    return f"{date} {time}"
+
+
 def putGPS(val, info):
     for (field, fieldRe, refVals) in (
         ("Latitude", LAT_RE, ("N", "S")),
@@ -330,14 +1320,509 @@ def putGPS(val, info):
     info[f"{GPS}MapDatum"] = "WGS-84"
 
 
+def readBackGPS(val, current=""):
+    """The location as `getGPS` reads it after `putGPS` has written `val`.
+
+    Latitude and longitude are stored in degrees, minutes and seconds,
+    so they do not come back exactly as they were written.
+    `current` is the location before, as `getGPS` gives it:
+    fields that are empty in `val` are not written, so they stay as they were.
+    """
+    values = {}
+    for (field, fieldRe, refs) in (
+        ("lat", LAT_RE, ("N", "S")),
+        ("lng", LNG_RE, ("E", "W")),
+        ("alt", ALT_RE, None),
+    ):
+        fieldVal = fieldRe.findall(val)
+        fieldVal = fieldVal[0] if fieldVal else ""
+        if not fieldVal:
+            fieldVal = fieldRe.findall(current)
+            values[field] = fieldVal[0] if fieldVal else ""
+            continue
+        fieldVal = float(fieldVal)
+        if refs is None:
+            values[field] = fieldVal
+        else:
+            ref = refs[0] if fieldVal >= 0 else refs[1]
+            values[field] = dms_to_decimal(*decimal_to_dms(fieldVal), ref)
+    return f"lat={values['lat']} lng={values['lng']} alt={values['alt']}"
+
+
+class RateLimiter:
+    """Token bucket for calls to Flickr.
+
+    The bucket holds at most `burst` tokens and is refilled at a rate of
+    `callsPerHour`. Every call takes a token, and waits for it if there is none.
+    Because refilling goes on while a call is being made, the time that calls
+    take counts towards the limit.
+
+    When Flickr reports that we go too fast, all calls pause for a while,
+    longer with every consecutive report.
+    """
+
+    def __init__(self, callsPerHour, burst, maxBackoff, retries):
+        self.rate = callsPerHour / 3600
+        self.burst = burst
+        self.maxBackoff = maxBackoff
+        self.retries = retries
+        self.tokens = burst
+        self.last = monotonic()
+        self.pauseUntil = 0
+        self.lock = threading.Lock()
+
+        self.calls = 0
+        self.throttled = 0
+        self.backoffs = 0
+
+    def acquire(self):
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+
+            delay = max(0, self.pauseUntil - now)
+            if self.tokens < 1:
+                delay = max(delay, (1 - self.tokens) / self.rate)
+            self.tokens -= 1
+
+            self.calls += 1
+            self.throttled += delay
+
+        if delay > 0:
+            sleep(delay)
+
+    def backoff(self, attempt):
+        with self.lock:
+            pause = min(self.maxBackoff, 2 ** (attempt + 1))
+            self.pauseUntil = max(self.pauseUntil, monotonic() + pause)
+            self.tokens = min(self.tokens, 0)
+            self.backoffs += 1
+        return pause
+
+    def report(self):
+        return (
+            f"Flickr calls: {self.calls}; "
+            f"throttled {self.throttled:.1f}s; "
+            f"backed off {self.backoffs} times"
+        )
+
+
+def isRateLimited(error):
+    """Whether Flickr asks us to slow down: HTTP status 429 or 503.
+
+    Flickr may also answer a call that comes while it is overloaded with
+    error 105 in the response itself, and that passes as well after a pause.
+    """
+    return (
+        error.code == SERVICE_UNAVAILABLE
+        or RATE_LIMITED_RE.search(str(error)) is not None
+    )
+
+
+class Plan:
+    """The changes to Flickr that a dry run would have made.
+
+    Instead of being sent to Flickr, every change is added here,
+    with the number of bytes that it would have uploaded.
+    """
+
+    def __init__(self):
+        self.changes = []
+        self.lock = threading.Lock()
+
+    def add(self, method, size, **kwargs):
+        with self.lock:
+            self.changes.append(dict(method=method, bytes=size, args=kwargs))
+
+    def summary(self, limiter):
+        """Count the calls and bytes per method and estimate the time they take.
+
+        The reads that the dry run has made itself, a real run makes too:
+        they are counted by the limiter and added to the calls.
+        The calls go at the rate of the limiter, after an initial burst;
+        the uploads at UPLOAD_SPEED.
+        """
+        methods = {}
+        for change in self.changes:
+            info = methods.setdefault(change["method"], dict(calls=0, bytes=0))
+            info["calls"] += 1
+            info["bytes"] += change["bytes"]
+
+        reads = limiter.calls
+        calls = len(self.changes) + reads
+        size = sum(info["bytes"] for info in methods.values())
+        seconds = max(0, calls - limiter.burst) / limiter.rate + size / UPLOAD_SPEED
+        return dict(
+            calls=calls,
+            reads=reads,
+            bytes=size,
+            seconds=round(seconds),
+            methods=methods,
+        )
+
+    def report(self, limiter):
+        summary = self.summary(limiter)
+        (minutes, seconds) = divmod(summary["seconds"], 60)
+        (hours, minutes) = divmod(minutes, 60)
+
+        lines = ["Planned changes on Flickr"]
+        for (method, info) in sorted(summary["methods"].items()):
+            size = f", {info['bytes'] / 1e6:.1f} MB" if info["bytes"] else ""
+            lines.append(f"\t{method:<28} : {info['calls']:>6} calls{size}")
+        lines.append(
+            f"""Reads     : {summary["reads"]:>6}
+Calls     : {summary["calls"]:>6}
+Uploads   : {summary["bytes"] / 1e6:>6.1f} MB
+Time      : {hours}h {minutes:02d}m {seconds:02d}s
+"""
+        )
+        return "\n".join(lines)
+
+    def write(self, path, limiter):
+        data = dict(summary=self.summary(limiter), changes=self.changes)
+        with open(path, "w") as fh:
+            json.dump(data, fh, indent=1)
+
+
+class Profile:
+    """Where the time of a run goes.
+
+    Phases are timed by name, each time they are entered;
+    phases that run in several threads at the same time add up their times.
+    Calls to Flickr are counted per method, with their latencies,
+    in buckets as in LATENCY_BUCKETS, and the bytes that they upload.
+    The time spent waiting for the rate limit is not part of the latency.
+    """
+
+    def __init__(self):
+        self.started = datetime.now()
+        self.start = perf_counter()
+        self.phases = {}
+        self.methods = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            with self.lock:
+                info = self.phases.setdefault(name, dict(count=0, seconds=0))
+                info["count"] += 1
+                info["seconds"] += elapsed
+
+    def timed(self, name, fn):
+        """Time a function as a phase, every time it is called."""
+
+        def timedFn(*args, **kwargs):
+            with self.phase(name):
+                return fn(*args, **kwargs)
+
+        return timedFn
+
+    def call(self, method, elapsed, size, error):
+        bucket = next(
+            (f"<={bound}" for bound in LATENCY_BUCKETS if elapsed <= bound),
+            f">{LATENCY_BUCKETS[-1]}",
+        )
+        with self.lock:
+            info = self.methods.setdefault(
+                method, dict(calls=0, errors=0, seconds=0, bytes=0, latency={})
+            )
+            info["calls"] += 1
+            info["errors"] += 1 if error else 0
+            info["seconds"] += elapsed
+            info["bytes"] += size
+            info["latency"][bucket] = info["latency"].get(bucket, 0) + 1
+
+    def write(self, path, limiter, **run):
+        """Write the report of the run, with `run` telling what has been run."""
+
+        def rounded(infos):
+            return {
+                name: dict(info, seconds=round(info["seconds"], 3))
+                for (name, info) in infos.items()
+            }
+
+        data = dict(
+            **run,
+            started=self.started.isoformat(),
+            seconds=round(perf_counter() - self.start, 3),
+            phases=rounded(self.phases),
+            flickr=dict(
+                calls=limiter.calls,
+                throttled=round(limiter.throttled, 3),
+                backoffs=limiter.backoffs,
+                methods=rounded(self.methods),
+            ),
+        )
+        with open(path, "w") as fh:
+            json.dump(data, fh, indent=1)
+
+
+def timed(method):
+    """Time a method of Make as a phase of the run, under its own name."""
+
+    @functools.wraps(method)
+    def timedMethod(self, *args, **kwargs):
+        with self.profile.phase(method.__name__):
+            return method(self, *args, **kwargs)
+
+    return timedMethod
+
+
+def flickrMethod(method):
+    """The name of a Flickr method, as in the Flickr API, without `flickr.`."""
+    name = getattr(method, "method_name", None) or method.__name__
+    return name.removeprefix("flickr.")
+
+
+def reorderPrefix(current, target):
+    """How many photos at the start of `target` must be moved to the front.
+
+    Reordering an album on Flickr puts the photos passed to it in front,
+    in the order passed, and keeps the other photos in their order.
+    So what follows the moved photos in `target` must already be in the
+    order of `current`.
+    Both contain the same photos.
+
+    >>> reorderPrefix(["a", "b", "c", "d"], ["a", "b", "c", "d"])
+    0
+    >>> reorderPrefix(["a", "b", "c", "d"], ["d", "a", "b", "c"])
+    1
+    >>> reorderPrefix(["a", "b", "c", "d"], ["b", "a", "c", "d"])
+    1
+    >>> reorderPrefix(["a", "b", "c", "d"], ["d", "c", "b", "a"])
+    3
+    """
+    position = {photoId: i for (i, photoId) in enumerate(current)}
+    k = max(0, len(target) - 1)
+    while k > 0 and position[target[k - 1]] < position[target[k]]:
+        k -= 1
+    return k
+
+
+def albumEdit(current, target, newPrimary):
+    """The cheapest way to give an album the photos of `target`, in that order.
+
+    `current` are the photos in the album now, in their order, and `newPrimary`
+    tells whether the album gets another primary photo.
+    Either the album is edited in full, in a single call with all photos,
+    or only the differences are sent: photos to add, photos to remove and
+    as few photos to reorder as possible.
+    A call costs as much as sending IDS_COST photo ids.
+    Lists of more than MAX_IDS photos are sent in chunks,
+    so big albums are always edited photo by photo.
+
+    Returns `full`, `delta` or `none`, the photos to add, the photos to remove,
+    and how many photos at the start of `target` must be moved to the front.
+
+    >>> albumEdit(["a", "b", "c"], ["a", "b", "c"], False)
+    ('none', [], [], 0)
+    >>> albumEdit(["a", "b", "c"], ["a", "b", "c"], True)
+    ('delta', [], [], 0)
+    >>> albumEdit(["a", "b", "c"], ["a", "b", "c", "d"], False)
+    ('delta', ['d'], [], 0)
+    >>> albumEdit(["a", "b", "c", "d"], ["d", "c", "b", "a"], False)
+    ('delta', [], [], 3)
+    >>> albumEdit(["a", "b", "c"], ["d", "a", "b"], False)
+    ('full', ['d'], ['c'], 1)
+    >>> photoIds = [str(i) for i in range(MAX_IDS + 1)]
+    >>> albumEdit([], photoIds[0:MAX_IDS], False)[0]
+    'full'
+    >>> albumEdit([], photoIds, False)[0]
+    'delta'
+    """
+    currentSet = set(current)
+    targetSet = set(target)
+    added = [photoId for photoId in target if photoId not in currentSet]
+    removed = [photoId for photoId in current if photoId not in targetSet]
+
+    # Flickr puts added photos at the end
+    after = [photoId for photoId in current if photoId in targetSet] + added
+    k = reorderPrefix(after, target)
+
+    deltaCalls = (
+        len(added)
+        + len(chunks(removed, MAX_IDS))
+        + len(chunks(target[0:k], MAX_IDS))
+        + (1 if newPrimary else 0)
+    )
+    deltaCost = deltaCalls + (len(removed) + k) / IDS_COST
+    fullCost = 1 + len(target) / IDS_COST
+
+    if len(target) <= MAX_IDS and fullCost < deltaCost:
+        how = "full"
+    elif deltaCalls:
+        how = "delta"
+    else:
+        how = "none"
+    return (how, added, removed, k)
+
+
+def chunks(items, size):
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+PIPELINE_END = object()
+
+
+def runPipeline(items, stages, size=QUEUE_SIZE):
+    """Pass items through stages that work at the same time.
+
+    Each stage is a pair of a function and a number of workers.
+    The function gets an item and returns the item for the next stage,
+    or None if the item drops out.
+    Stages are connected by queues of at most `size` items, so a stage that
+    is ahead waits for the slower stages after it.
+    The order of the items is kept.
+
+    Yields the items that come out of the last stage.
+    If a stage raises an exception, all stages stop and the exception is
+    raised here.
+
+    >>> def odd(n):
+    ...     return n if n % 2 else None
+    >>> list(runPipeline(range(8), [(lambda n: n * n, 4), (odd, 2)], size=2))
+    [1, 9, 25, 49]
+    >>> def check(n):
+    ...     if n == 3:
+    ...         raise ValueError(n)
+    ...     return n
+    >>> list(runPipeline(range(100), [(check, 4), (str, 1)], size=2))
+    Traceback (most recent call last):
+    ...
+    ValueError: 3
+    >>> pipeline = runPipeline(range(100), [(str, 2)], size=2)
+    >>> (next(pipeline), next(pipeline))
+    ('0', '1')
+    >>> pipeline.close()
+    """
+    queues = [queue.Queue(maxsize=size) for i in range(len(stages) + 1)]
+    errors = []
+    stop = threading.Event()
+
+    def fail(e):
+        errors.append(e)
+        stop.set()
+
+    def feed():
+        try:
+            for item in items:
+                if stop.is_set():
+                    break
+                queues[0].put(item)
+        except Exception as e:
+            fail(e)
+        finally:
+            queues[0].put(PIPELINE_END)
+
+    def collect(pending, outQ):
+        while True:
+            future = pending.get()
+            if future is PIPELINE_END:
+                break
+            try:
+                result = future.result()
+            except Exception as e:
+                fail(e)
+                continue
+            if result is not None and not stop.is_set():
+                outQ.put(result)
+        outQ.put(PIPELINE_END)
+
+    def work(fn, workers, inQ, outQ):
+        pending = queue.Queue(maxsize=size)
+        collector = threading.Thread(target=collect, args=(pending, outQ), daemon=True)
+        collector.start()
+
+        item = None
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                while True:
+                    item = inQ.get()
+                    if item is PIPELINE_END:
+                        break
+                    if not stop.is_set():
+                        pending.put(executor.submit(fn, item))
+        except Exception as e:
+            fail(e)
+            # let the stage before this one run dry
+            while item is not PIPELINE_END:
+                item = inQ.get()
+        finally:
+            pending.put(PIPELINE_END)
+            collector.join()
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for (i, (fn, workers)) in enumerate(stages):
+        threads.append(
+            threading.Thread(
+                target=work,
+                args=(fn, workers, queues[i], queues[i + 1]),
+                daemon=True,
+            )
+        )
+    for thread in threads:
+        thread.start()
+
+    finished = False
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is PIPELINE_END:
+                finished = True
+                break
+            if not stop.is_set():
+                yield item
+    finally:
+        if not finished:
+            # the consumer gave up: let the stages run dry
+            stop.set()
+            while queues[-1].get() is not PIPELINE_END:
+                pass
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+
+
+def connectFlickr(C, names):
+    """Connect to Flickr with the key of the configuration, with write access.
+
+    The first time, the user has to authorize updatr in the browser.
+    """
+    FL = flickrapi.FlickrAPI(
+        C.flickrKey, C.flickrSecret, format="parsed-json", cache=CACHE
+    )
+
+    if not FL.token_valid(perms="write"):
+        FL.get_request_token(oauth_callback="oob")
+        authorize_url = FL.auth_url(perms="write")
+        webbrowser.open_new_tab(authorize_url)
+        verifier = str(input("Verifier code: "))
+        FL.get_access_token(verifier)
+    return FL
+
+
 class Make:
-    def __init__(self, source, name):
+    def __init__(self, source, name, options=None, flickr=connectFlickr):
+        """`flickr` makes the connection to Flickr, out of the configuration
+        and the names of the photos; by default it connects to Flickr itself.
+        """
+
         class C:
             pass
 
         self.C = C
         self.source = source
         self.name = name
+        self.options = {} if options is None else options
+        self.flickr = flickr
 
         if not self.config():
             quit()
@@ -359,12 +1844,18 @@ class Make:
             return None
 
         settings = readYaml(configPath)
+        c["metaLayout"] = "files"
         for (k, v) in settings.items():
             c[k] = v
 
+        if c["metaLayout"] not in STORES:
+            console(f"Unknown metaLayout `{c['metaLayout']}` in {configPath}")
+            return None
+
         c["metaOutDir"] = f"{LOCAL_DIR}/{source}/metadata"
         c["metaxOutDir"] = f"{LOCAL_DIR}/{source}/metadatax"
         c["metafOutDir"] = f"{IMAGE_BASE}/{source}/metadatafull"
+        c["localDir"] = f"{LOCAL_DIR}/{source}"
 
         if not os.path.exists(FLICKR_CONFIG):
             console(f"No flickr config file found: {FLICKR_CONFIG}")
@@ -374,20 +1865,97 @@ class Make:
         for (k, v) in flickrSettings.items():
             c[k] = v
 
+        rateLimit = dict(RATE_LIMIT)
+        rateLimit.update(c.get("rateLimit", None) or {})
+        unknown = set(rateLimit) - set(RATE_LIMIT)
+        if unknown:
+            console(f"Unknown rateLimit settings in {FLICKR_CONFIG}: {unknown}")
+            return None
+        self.limiter = RateLimiter(**rateLimit)
+        self.profile = Profile()
+
         for (k, v) in c.items():
             setattr(C, k, v)
 
         if not self.collectPhotos():
             return None
 
-        for wd in (C.metaOutDir, C.metaxOutDir, C.metafOutDir):
+        workDirs = (C.metaOutDir, C.metaxOutDir, C.metafOutDir)
+        if C.metaLayout != "files":
+            workDirs = (C.localDir,)
+
+        for wd in workDirs:
             if not os.path.exists(wd):
                 os.makedirs(wd, exist_ok=True)
 
+        self.stores = {}
+        self.planned = Plan() if self.options.get("dry-run", False) else None
+        self.journal = None
+
+        self.fast = not self.options.get("exiv2", False)
+        self.index = MetaIndex(f"{C.localDir}/{INDEX_FILE}", fast=self.fast)
+        self.metaCache = {}
+        if not C.photoName:
+            self.index.prune(self.allPhotos)
+
         return True
 
     def doCommand(self, command, flag):
-        getattr(self, command)(flag=flag)
+        if self.planned is not None:
+            console("Dry run: nothing will be changed")
+        try:
+            getattr(self, command)(flag=flag)
+        finally:
+            for store in self.stores.values():
+                store.flush()
+            self.index.commit()
+            planned = self.planned
+            snapshot = getattr(self, "snapshot", None)
+            # a dry run has changed the snapshot as if its plan has been carried out
+            if snapshot is not None and planned is None:
+                snapshot.save()
+            # a stand-in for Flickr may keep an account of its own
+            save = getattr(getattr(self, "FL", None), "save", None)
+            if save is not None and planned is None:
+                save()
+            # an interrupted sync leaves its journal behind
+            if self.journal is not None:
+                self.journal.close()
+            if self.limiter.calls:
+                console(self.limiter.report())
+            profilePath = self.options.get("profile", None)
+            if profilePath is not None:
+                self.profile.write(
+                    profilePath,
+                    self.limiter,
+                    source=self.source,
+                    photo=self.name,
+                    command=command,
+                    flag=flag,
+                    options=self.options,
+                    photos=len(self.photos),
+                )
+                console(f"Profile written to {profilePath}")
+            if planned is not None:
+                planPath = f"{self.C.localDir}/{PLAN_FILE}"
+                planned.write(planPath, self.limiter)
+                console(planned.report(self.limiter))
+                console(f"Plan written to {planPath}")
+
+    def getSnapshot(self):
+        if getattr(self, "snapshot", None) is None:
+            snapshot = FlickrSnapshot(f"{self.C.localDir}/{SNAPSHOT_FILE}")
+            if not self.options.get("refresh-remote", False):
+                snapshot.load()
+            self.snapshot = snapshot
+        return self.snapshot
+
+    def getStore(self, path):
+        stores = self.stores
+
+        if path not in stores:
+            stores[path] = STORES[self.C.metaLayout](path)
+        return stores[path]
 
     def collectPhotos(self):
         C = self.C
@@ -425,242 +1993,642 @@ class Make:
         self.photos = photos
         return True
 
+    def getMeta(self, name, expanded):
+        C = self.C
+        metaCache = self.metaCache
+        key = (name, expanded)
+
+        if key not in metaCache:
+            inPath = f"{C.photosDir}/{name}.jpg"
+            with self.profile.phase("getMeta"):
+                metaCache[key] = getPhotoMeta(
+                    inPath, C.metaDefaults, expanded, index=self.index
+                )
+        return metaCache[key]
+
+    def forgetMeta(self, name):
+        metaCache = self.metaCache
+
+        for expanded in (True, False):
+            metaCache.pop((name, expanded), None)
+
     def getKeywords(self):
+        """Collect the keywords of the photos."""
         C = self.C
         defaults = C.metaDefaults
 
-        allPhotos = self.allPhotos
         keywordSet = set(defaults["keywords"])
         allKeywordSet = set(defaults["keywords"])
         self.keywordSet = allKeywordSet
         self.allKeywordSet = allKeywordSet
 
-        for name in allPhotos:
-            inPath = f"{C.photosDir}/{name}.jpg"
+        (keywordsFromPhoto, photosFromKeyword) = self.getKeywordIndex()
+        allKeywordSet |= set(photosFromKeyword)
+        if C.photoName:
+            keywordSet |= keywordsFromPhoto[C.photoName]
 
-            keywords = getPhotoMeta(inPath, defaults, True)["keywords"]
-            allKeywordSet |= set(keywords)
-            if name == C.photoName:
-                keywordSet |= set(keywords)
+    @timed
+    def getKeywordIndex(self):
+        """The keywords of the photos, per photo and per keyword.
+
+        The keywords are kept in the index, with the size and modification
+        time of the photo that they have been read from.
+        Only photos that have changed since are read again.
+        """
+        C = self.C
+        index = self.index
+
+        (signatures, keywordsFromPhoto, photosFromKeyword) = index.getKeywords()
+        allPhotos = set(self.allPhotos)
+
+        for name in self.allPhotos:
+            signature = fileStamp(f"{C.photosDir}/{name}.jpg")
+            if signatures.get(name, None) == signature:
+                continue
 
+            for keyword in keywordsFromPhoto.get(name, set()):
+                photosFromKeyword[keyword].discard(name)
+            keywords = set(self.getMeta(name, True)["keywords"])
+            keywordsFromPhoto[name] = keywords
+            for keyword in keywords:
+                photosFromKeyword.setdefault(keyword, set()).add(name)
+            index.setKeywords(name, signature, keywords)
+
+        # photos that are no longer in the collection
+        for name in set(keywordsFromPhoto) - allPhotos:
+            for keyword in keywordsFromPhoto.pop(name):
+                photosFromKeyword[keyword].discard(name)
+
+        photosFromKeyword = {
+            keyword: names for (keyword, names) in photosFromKeyword.items() if names
+        }
+        return (keywordsFromPhoto, photosFromKeyword)
+
+    @timed
     def getDates(self):
+        """Collect the dates of the photos.
+
+        The date in the metadata record counts, otherwise the date in the photo.
+        The dates are kept in the index, with the sizes and modification times
+        of the record and the photo that they have been taken from.
+        Only for records and photos that have changed since,
+        the date is looked up again.
+        """
         C = self.C
+        index = self.index
 
         allPhotos = self.allPhotos
         photoDates = {}
         self.photoDates = photoDates
 
+        store = self.getStore(C.metaDir)
+        files = store.layout == "files"
+        storeStamp = None if files else fileStamp(store.path)
+
+        known = index.getDates()
+        changed = []
+
         for name in allPhotos:
-            yamlFile = f"{C.metaDir}/{name}.yaml"
+            recordStamp = fileStamp(store.filePath(name)) if files else storeStamp
+            photoStamp = fileStamp(f"{C.photosDir}/{name}.jpg")
+            signature = f"{recordStamp} {photoStamp}"
 
-            if os.path.exists(yamlFile):
-                logical = readYaml(yamlFile)
-                sanitize(logical)
-            else:
+            entry = known.get(name, None)
+            if entry is not None and entry[0] == signature:
+                photoDates[name] = entry[1]
+                continue
+
+            logical = store.get(name)
+
+            if logical is None:
                 logical = {}
+            else:
+                logical = dict(logical)
+                sanitize(logical)
+
+            datetime = (
+                logical["datetime"]
+                if "datetime" in logical
+                else self.getMeta(name, True).get("datetime", "")
+            )
+            photoDates[name] = datetime
+            changed.append((name, signature, datetime))
+
+        index.setDates(changed)
+
+    @timed
+    def importmeta(self, flag=None):
+        C = self.C
+        defaults = C.metaDefaults
+        jobs = self.options.get("jobs", 1)
+
+        force = flag == "force" or C.photoName
+
+        photos = self.photos
+
+        unchanged = 0
+        updated = 0
+        errors = {}
+
+        console("Apply metadata ...")
+
+        store = self.getStore(C.metaDir)
+        todo = []
+
+        for name in photos:
+            task = self.applyTask(name, store, force)
+            if task is None:
+                unchanged += 1
+                continue
+
+            todo.append((name, *task))
+
+        tasks = [(*task, defaults, C.colofon) for (_, _, task) in todo]
+
+        if jobs > 1 and len(tasks) > 1:
+            pool = ProcessPoolExecutor(max_workers=jobs)
+            chunkSize = max(1, len(tasks) // (jobs * 4))
+            results = pool.map(applyMeta, *zip(*tasks), chunksize=chunkSize)
+        else:
+            pool = None
+            results = (applyMeta(*task) for task in tasks)
+
+        try:
+            for ((name, digest, _), error) in zip(todo, results):
+                if self.recordApplied(name, digest, error):
+                    updated += 1
+                else:
+                    errors[name] = error
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        console(
+            f"""Import Metadata
+Unchanged : {unchanged:>4}
+Updated   : {updated:>4}
+"""
+        )
+        if errors:
+            console(f"Failed    : {len(errors):>4}", error=True)
+            for (name, error) in errors.items():
+                console(f"\t{name}: {error}", error=True)
+
+    def doneByTimes(self, changed, done, record):
+        """Whether a photo without a recorded state is done, going by times.
+
+        Earlier versions did not record states, only modification times:
+        the photo is done if it has not been `changed` after it has been `done`,
+        both timestamps.
+        If so, `record` is called to record its state, except in a dry run.
+        """
+        if changed > done:
+            return False
+        if self.planned is None:
+            record()
+        return True
+
+    def applyTask(self, name, store, force):
+        """Whether the metadata record of a photo has to be applied to it.
+
+        Returns None if not, otherwise the digest of the record and the
+        record, its path and the path of the photo, as `applyMeta` wants them.
+        """
+        C = self.C
+        index = self.index
+        stream = store.layout == "stream"
+        outPath = f"{C.photosDir}/{name}.jpg"
+
+        # change detection by the digest of the metadata record
+        if stream:
+            inPath = None
+            logical = store.get(name)
+            digest = None if logical is None else recordDigest(logical)
+        else:
+            inPath = store.filePath(name)
+            logical = None
+            digest = (
+                index.digest(inPath, "record", yamlDigest)
+                if os.path.exists(inPath)
+                else None
+            )
+
+        if not force:
+            if digest is None:
+                return None
+
+            applied = index.getState("applied", name)
+            if (
+                applied is None
+                and not stream
+                and self.doneByTimes(
+                    os.path.getmtime(inPath),
+                    os.path.getmtime(outPath),
+                    lambda: index.setState("applied", name, digest),
+                )
+            ):
+                applied = digest
+
+            if digest == applied:
+                return None
+
+        return (digest, (logical, inPath, outPath))
+
+    def recordApplied(self, name, digest, error):
+        self.forgetMeta(name)
+        if error is None:
+            if digest is not None:
+                self.index.setState("applied", name, digest)
+            console(f"\tapplied to {name}")
+            return True
+
+        console(f"\tfailed for {name}: {error}", error=True)
+        return False
+
+    @timed
+    def exportmetafull(self, flag=None):
+        C = self.C
+        store = self.getStore(C.metafOutDir)
+
+        photos = self.photos
+
+        force = flag == "force" or C.photoName
+
+        unchanged = 0
+        todo = []
+
+        console("Generate full metadata ...")
+
+        index = self.index
+        digests = {}
+
+        for name in photos:
+            digest = self.exportTask(name, store, force)
+            if digest is None:
+                unchanged += 1
+                continue
+
+            digests[name] = digest
+            todo.append(name)
+
+        # in the stream layout only the records that have changed count as updated
+        updated = self.writeMeta(todo, store, True)
+        unchanged += len(todo) - updated
+
+        for name in todo:
+            index.setState("exported", name, digests[name])
+
+        console(
+            f"""Write Metadata Full
+Unchanged : {unchanged:>4}
+Updated   : {updated:>4}
+"""
+        )
+
+    def exportTask(self, name, store, force):
+        """Whether the full metadata of a photo has to be exported.
+
+        Returns None if not, otherwise the digest of the metadata in the photo.
+        """
+        C = self.C
+        index = self.index
+        files = store.layout == "files"
+        inPath = f"{C.photosDir}/{name}.jpg"
+
+        if not os.path.exists(inPath):
+            return None
+
+        # change detection by the digest of the metadata in the photo
+        digest = index.digest(inPath, "meta", metaDigest)
+
+        if not force:
+            outPath = store.filePath(name) if files else None
+            present = os.path.exists(outPath) if files else store.get(name) is not None
+            exported = index.getState("exported", name)
+
+            if (
+                exported is None
+                and present
+                and files
+                and self.doneByTimes(
+                    os.path.getmtime(inPath),
+                    os.path.getmtime(outPath),
+                    lambda: index.setState("exported", name, digest),
+                )
+            ):
+                exported = digest
+
+            if present and digest == exported:
+                return None
+
+        return digest
+
+    def exportmeta(self, flag=None):
+        expanded = flag == "full"
+        C = self.C
+        store = self.getStore(C.metaxOutDir if expanded else C.metaOutDir)
+
+        photos = self.photos
+
+        self.writeMeta(photos, store, expanded)
+
+    def writeMeta(self, names, store, expanded):
+        C = self.C
+        defaults = C.metaDefaults
+        index = self.index
+        jobs = self.options.get("jobs", 1)
+        pool = self.options.get("pool", "thread")
+
+        files = store.layout == "files"
+        if files:
+            os.makedirs(store.path, exist_ok=True)
+        updated = 0
+
+        start = perf_counter()
+
+        if jobs > 1 and len(names) > 1:
+            tasks = []
+            stats = []
+
+            for name in names:
+                inPath = f"{C.photosDir}/{name}.jpg"
+                outPath = store.filePath(name) if files else None
+                stat = os.stat(inPath)
+                actual = index.lookup(inPath, stat)
+                tasks.append((inPath, outPath, defaults, expanded, actual, self.fast))
+                stats.append(stat)
+
+            chunkSize = max(1, len(tasks) // (jobs * 4))
+
+            with POOLS[pool](max_workers=jobs) as executor:
+                results = executor.map(exportMeta, *zip(*tasks), chunksize=chunkSize)
+                for (name, task, stat, (actual, metadata)) in zip(
+                    names, tasks, stats, results
+                ):
+                    if task[4] is None:
+                        index.store(task[0], stat, actual)
+                    if files or store.put(name, metadata):
+                        updated += 1
+        else:
+            for name in names:
+                metadata = self.getMeta(name, expanded)
+                if store.put(name, metadata):
+                    updated += 1
 
-            datetime = logical.get(
-                "datetime", getPhotoDate(f"{C.photosDir}/{name}.jpg")
+        elapsed = perf_counter() - start
+        if names:
+            workers = f"{jobs} {pool} workers" if jobs > 1 else "no workers"
+            console(
+                f"\tExported metadata of {len(names)} photos in {elapsed:.2f}s "
+                f"with {workers}: {len(names) / elapsed:.1f} photos/second"
             )
-            photoDates[name] = datetime
+        return updated
 
-    def importmeta(self, flag=None):
+    def convertmeta(self, flag=None):
         C = self.C
-        defaults = C.metaDefaults
-
-        force = flag == "force" or C.photoName
-
-        photos = self.photos
-
-        unchanged = 0
-        updated = 0
+        index = self.index
+        layout = flag
 
-        console("Apply metadata ...")
+        console(f"Convert metadata to the {layout} layout ...")
 
-        for name in photos:
-            inPath = f"{C.metaDir}/{name}.yaml"
-            outPath = f"{C.photosDir}/{name}.jpg"
+        for path in (C.metaDir, C.metafOutDir, C.metaOutDir, C.metaxOutDir):
+            for (otherLayout, Store) in STORES.items():
+                if otherLayout == layout:
+                    continue
 
-            if not force:
-                if not os.path.exists(inPath) or os.path.getmtime(
-                    inPath
-                ) <= os.path.getmtime(outPath):
-                    unchanged += 1
+                source = Store(path)
+                target = STORES[layout](path)
+                names = source.names()
+                if not names:
                     continue
 
-            if os.path.exists(inPath):
-                logical = readYaml(inPath)
-                sanitize(logical)
-            else:
-                logical = {}
+                for name in names:
+                    record = source.get(name)
+                    target.put(name, record)
 
-            info = pyexiv2.ImageMetadata(outPath)
-            info.read()
+                    if path == C.metaDir and otherLayout == "files":
+                        # records that have already been applied to their
+                        # photos need not be applied again
+                        inPath = source.filePath(name)
+                        outPath = f"{C.photosDir}/{name}.jpg"
+                        if os.path.exists(outPath) and os.path.getmtime(
+                            inPath
+                        ) <= os.path.getmtime(outPath):
+                            index.setState("applied", name, recordDigest(record))
 
-            actual = {}
-            for (log, iName, eName) in METADATA:
-                if log == "keywords":
-                    val = sorted(set(logical.get(log, [])) | set(defaults[log]))
-                else:
-                    val = logical.get(log, None)
-                    if val is None:
-                        val = defaults.get(log, None)
-                actual[log] = val
-
-            if actual.get("source", None) is not None:
-                actual["sourceAsUrl"] = urllib.parse.quote_plus(actual["source"])
-            cpr = actual.get("copyright", None)
-            caption = actual.get("caption", None)
-
-            if cpr is not None:
-                actual["copyright"] = cpr.format(**actual)
-            colofon = C.colofon.format(**actual)
-
-            if caption is None:
-                actual["caption"] = f"{CAPTION_SEP}{colofon}"
-            else:
-                caption = COLOFON_RE.sub("", caption)
-                actual["caption"] = f"{caption}{CAPTION_SEP}{colofon}"
+                target.flush()
+                source.remove()
+                console(f"\t{len(names):>5} records from {source.path}")
 
-            for (log, iName, eName) in METADATA:
-                val = actual[log]
-                if val is None:
-                    continue
-                if iName is not None:
-                    info[iName] = val if log == "keywords" else [val]
-                if eName is not None:
-                    info[eName] = val
-                if log == "datetime":
-                    info[f"{eName}Original"] = val
-                    (date, time) = val.split(" ")
-                    date = date.replace(":", "-")
-                    val = datetime.fromisoformat(f"{date}T{time}")
-                    info["Iptc.Application2.DateCreated"] = [val]
-                    info["Iptc.Application2.TimeCreated"] = [val]
-                    info["Iptc.Application2.DigitizationDate"] = [val]
-                    info["Iptc.Application2.DigitizationTime"] = [val]
-                elif log == "location":
-                    putGPS(val, info)
-
-            info.write()
-            console(f"\tapplied to {name}")
-            updated += 1
-        console(
-            f"""Import Metadata
-Unchanged : {unchanged:>4}
-Updated   : {updated:>4}
-"""
-        )
+        if C.metaLayout != layout:
+            console(f"Now set `metaLayout: {layout}` in the config.yaml of {C.source}")
 
-    def exportmetafull(self, flag=None):
+    def checkmeta(self, flag=None):
         C = self.C
-        defaults = C.metaDefaults
-        outDir = C.metafOutDir
 
         photos = self.photos
 
-        force = flag == "force" or C.photoName
-
-        unchanged = 0
-        updated = 0
+        same = 0
+        different = 0
+        fallback = 0
 
-        console("Generate full metadata ...")
+        console("Compare fast reader with pyexiv2 ...")
 
         for name in photos:
             inPath = f"{C.photosDir}/{name}.jpg"
-            outPath = f"{outDir}/{name}.yaml"
 
-            if not force:
-                if not os.path.exists(inPath) or (
-                    os.path.exists(outPath)
-                    and os.path.getmtime(inPath) <= os.path.getmtime(outPath)
-                ):
-                    unchanged += 1
-                    continue
+            info = readJpegInfo(inPath)
+            if info is None:
+                fallback += 1
+                continue
 
-            metadata = getPhotoMeta(inPath, defaults, True)
+            fast = extractMeta(info)
+            full = readPhotoMeta(inPath, fast=False)
 
-            with open(outPath, "w") as exh:
-                yaml.dump(metadata, exh, allow_unicode=True)
+            if fast == full:
+                same += 1
+                continue
 
-            updated += 1
+            different += 1
+            console(f"\t{name}:", error=True)
+            for (log, val) in full.items():
+                if fast[log] != val:
+                    console(f"\t\t{log}: {fast[log]!r} versus {val!r}", error=True)
 
         console(
-            f"""Write Metadata Full
-Unchanged : {unchanged:>4}
-Updated   : {updated:>4}
+            f"""Compare Metadata Readers
+Same      : {same:>4}
+Different : {different:>4}
+Fallback  : {fallback:>4}
 """
         )
 
-    def exportmeta(self, flag=None):
-        expanded = flag == "full"
-        C = self.C
-        defaults = C.metaDefaults
-        outDir = C.metaxOutDir if expanded else C.metaOutDir
-
-        photos = self.photos
-
-        for name in photos:
-            inPath = f"{C.photosDir}/{name}.jpg"
-            outPath = f"{outDir}/{name}.yaml"
-
-            metadata = getPhotoMeta(inPath, defaults, expanded)
-
-            with open(outPath, "w") as exh:
-                yaml.dump(metadata, exh, allow_unicode=True)
-
     def sync(self, flag=None):
+        """Apply, export, upload and sort into albums, photo by photo.
+
+        The stages work at the same time, each on its own photos:
+        a photo is uploaded as soon as its metadata has been applied and
+        exported, while the next photos are still being prepared.
+        """
         C = self.C
         defaults = C.metaDefaults
+        jobs = self.options.get("jobs", 1)
+        uploads = self.options.get("uploads", 1)
+        planned = self.planned
 
         force = flag == "force" or C.photoName
 
         photos = self.photos
 
-        self.keywordSet = set()
-        self.importmeta(flag)
-        self.exportmetafull(flag=flag)
+        # what has been pushed to Flickr, of all photos at once
+        records = self.index.getPushed()
+        flickrUpdated = (
+            self.getFlickrUpdated() if any(n not in records for n in photos) else None
+        )
 
-        flickrUpdated = None if C.photoName else self.getFlickrUpdated()
+        journal = None
+        if not C.photoName and planned is None:
+            journal = SyncJournal(f"{C.localDir}/{JOURNAL_FILE}")
+            if journal.resumed():
+                console(
+                    f"Resuming an interrupted sync: {len(journal.photos)} photos "
+                    f"and {len(journal.albums)} albums already done on Flickr"
+                )
+            self.journal = journal
 
-        updates = []
+        # the albums on Flickr are fetched as soon as the first photo is
+        # uploaded, while metadata records are still being applied;
+        # albums of keywords that come in later are looked up by flFindAlbum
+        self.getKeywords()
 
-        console("Update on Flickr ...")
-        for name in photos:
-            inPath = f"{C.photosDir}/{name}.jpg"
+        metaStore = self.getStore(C.metaDir)
+        fullStore = self.getStore(C.metafOutDir)
+        if fullStore.layout == "files":
+            os.makedirs(fullStore.path, exist_ok=True)
+
+        albumLock = threading.Lock()
+        pool = (
+            ProcessPoolExecutor(max_workers=jobs)
+            if jobs > 1 and planned is None
+            else None
+        )
+
+        applied = []
+        applyErrors = {}
+        exported = []
+        uploaded = []
+        resumed = []
+        failed = {}
+        # in a dry run: the photos whose records would have been applied
+        pending = set()
+
+        def applyStage(name):
+            task = self.applyTask(name, metaStore, force)
+            if task is not None and planned is not None:
+                error = self.planMeta(name, task[1])
+                if error is None:
+                    applied.append(name)
+                    pending.add(name)
+                else:
+                    applyErrors[name] = error
+            elif task is not None:
+                (digest, task) = task
+                args = (*task, defaults, C.colofon)
+                error = (
+                    applyMeta(*args)
+                    if pool is None
+                    else pool.submit(applyMeta, *args).result()
+                )
+                if self.recordApplied(name, digest, error):
+                    applied.append(name)
+                else:
+                    applyErrors[name] = error
+            return name
+
+        def exportStage(name):
+            digest = self.exportTask(name, fullStore, force)
+            if planned is not None:
+                if digest is not None or name in pending:
+                    exported.append(name)
+            elif digest is not None:
+                if fullStore.put(name, self.getMeta(name, True)):
+                    exported.append(name)
+                self.index.setState("exported", name, digest)
+            return name
+
+        def uploadStage(name):
+            done = self.resumeTask(name)
             if (
-                not force
-                and flickrUpdated
-                and datetime.fromtimestamp(os.path.getmtime(inPath)) <= flickrUpdated
+                done is None
+                and name not in pending
+                and not self.uploadTask(name, force, records, flickrUpdated)
             ):
-                continue
-            updates.append((name, inPath))
+                return None
 
-        console(f"\t{len(updates)} update{'' if len(updates) == 1 else 's'} needed")
-        if updates:
-            if not getattr(self, "albumFromId", None):
-                self.flGetAlbums(touchMain=True)
+            with albumLock:
+                if not getattr(self, "albumFromId", None):
+                    self.flGetAlbums(touchMain=True, readKeywords=False)
 
-            console("Sync photo updates with Flickr")
-            for (name, inPath) in updates:
-                metadata = getPhotoMeta(inPath, defaults, True)
-                self.flPutPhoto(name, metadata)
-                console(f"\tupdated on Flickr {name}")
+            # put on Flickr by the interrupted sync, but its albums still
+            # have to be updated
+            if done is not None:
+                resumed.append(name)
+                return name
+
+            error = self.flUploadPhoto(name, force=force)
+            if error is not None:
+                failed[name] = error
+                console(f"\tfailed on Flickr {name}: {error}", error=True)
+                return None
+            return name
+
+        profileTimed = self.profile.timed
+        stages = (
+            (profileTimed("sync.apply", applyStage), jobs),
+            (profileTimed("sync.export", exportStage), 1),
+            (profileTimed("sync.upload", uploadStage), uploads),
+        )
 
-            self.albumAdditions = {}
-            self.albumDeletions = {}
+        self.albumAdditions = {}
+        self.albumDeletions = {}
+        self.uploadsSaved = []
 
-            unchanged = 0
-            updated = 0
+        unchanged = 0
+        updated = 0
 
-            for (name, inPath) in updates:
-                metadata = getPhotoMeta(inPath, defaults, True)
-                thisUpdated = self.flPutAlbum(name, metadata, detectMetaChange=True)
-                if thisUpdated:
+        console("Apply, export and update on Flickr ...")
+        try:
+            for name in runPipeline(photos, stages):
+                uploaded.append(name)
+                console(f"\tupdated on Flickr {name}")
+                metadata = self.getMeta(name, True)
+                if self.flPutAlbum(name, metadata, detectMetaChange=True):
                     updated += 1
                 else:
                     unchanged += 1
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        console(
+            f"""Import Metadata
+Unchanged : {len(photos) - len(applied) - len(applyErrors):>4}
+Updated   : {len(applied):>4}
+"""
+        )
+        if applyErrors:
+            console(f"Failed    : {len(applyErrors):>4}", error=True)
+            for (name, error) in applyErrors.items():
+                console(f"\t{name}: {error}", error=True)
+
+        console(
+            f"""Write Metadata Full
+Unchanged : {len(photos) - len(exported):>4}
+Updated   : {len(exported):>4}
+"""
+        )
 
+        if uploaded:
             console(
                 f"""Get album membership changes:
 Unchanged : {unchanged:>4} photos
@@ -669,21 +2637,139 @@ Updated   : {updated:>4} photos
             )
             self.flApplyAlbums()
 
-        if not C.photoName:
-            self.setFlickrUpdated()
-        updated = len(updates)
-        unchanged = len(photos) - updated
+        if journal is not None:
+            journal.remove()
+            self.journal = None
+        uploadsSaved = self.uploadsSaved
         console(
             f"""Synced with Flickr
-Unchanged : {unchanged:>4}
-Updated   : {updated:>4}
+Unchanged : {len(photos) - len(uploaded) - len(failed):>4}
+Updated   : {len(uploaded):>4}
 """
         )
+        if uploadsSaved:
+            console(
+                f"Updated {len(uploadsSaved)} photos without uploading them, "
+                f"saving {sum(uploadsSaved) / 1e6:.1f} MB of uploads"
+            )
+        if resumed:
+            console(f"Updated {len(resumed)} photos already in the interrupted sync")
+        if failed:
+            console(f"Failed    : {len(failed):>4}", error=True)
+            for (name, error) in failed.items():
+                console(f"\t{name}: {error}", error=True)
+
+    def plan(self, flag=None):
+        """Sync in a dry run."""
+        if self.planned is None:
+            self.planned = Plan()
+            console("Dry run: nothing will be changed")
+        self.sync(flag=flag)
+
+    def planMeta(self, name, task):
+        """Let a photo have the metadata that applying its record would give it.
+
+        Only in memory, for a dry run: the photo itself is not changed.
+        `task` is as `applyTask` gives it.
+        Returns None, or, if the record cannot be read, the error as text.
+        """
+        C = self.C
+        (logical, inPath, outPath) = task
 
-    def albumsync(self, flag=None):
+        try:
+            logical = readRecord(logical, inPath)
+            actual = recordMeta(logical, C.metaDefaults, C.colofon)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            console(f"\tfailed for {name}: {error}", error=True)
+            return error
+
+        metadata = dict(self.getMeta(name, True))
+
+        for (log, iName, eName) in METADATA:
+            val = actual[log]
+            if val is None:
+                continue
+            if log == "location":
+                # as a real apply would write it and read it back
+                val = readBackGPS(val, metadata.get("location", ""))
+            if val or log == "keywords":
+                metadata[log] = val
+            else:
+                metadata.pop(log, None)
+
+        self.metaCache[(name, True)] = metadata
+        console(f"\twould apply to {name}")
+        return None
+
+    def resumeTask(self, name):
+        """Whether the interrupted sync has already put a photo on Flickr.
+
+        If so, what it has recorded of the photo is restored in the index,
+        and its journal entry is returned, otherwise None.
+        """
         C = self.C
-        defaults = C.metaDefaults
+        index = self.index
+        journal = self.journal
+
+        if journal is None or name not in journal.photos:
+            return None
 
+        inPath = f"{C.photosDir}/{name}.jpg"
+        stat = os.stat(inPath)
+        digest = index.digest(inPath, "file", fileDigest)
+        done = journal.getPhoto(name, digest)
+        if done is not None:
+            index.setPushed(name, done["id"], stat, digest, done["pushed"])
+        return done
+
+    def uploadTask(self, name, force, records, flickrUpdated):
+        """Whether a photo has to be updated on Flickr.
+
+        `records` has what has last been pushed of each photo,
+        see `MetaIndex.getPushed`.
+        A photo whose file has the size and modification time of its record
+        is not changed; only the other photos are digested.
+        `flickrUpdated` is the time of the last sync by earlier versions,
+        for photos without a record: if they have not been modified since,
+        they get a record without a digest, which holds as long as their
+        file keeps its size and modification time.
+        """
+        C = self.C
+        index = self.index
+        planned = self.planned
+        inPath = f"{C.photosDir}/{name}.jpg"
+
+        if force:
+            return True
+
+        record = records.get(name, None)
+        stat = os.stat(inPath)
+
+        if record is None:
+            return flickrUpdated is None or not self.doneByTimes(
+                stat.st_mtime,
+                flickrUpdated.timestamp(),
+                lambda: index.setPushed(name, None, stat, None, None),
+            )
+
+        # an empty digest marks a failed push
+        if (
+            record["file"] != ""
+            and record["size"] == stat.st_size
+            and record["mtime"] == stat.st_mtime_ns
+        ):
+            return False
+
+        # change detection by the digest of the photo file
+        digest = index.digest(inPath, "file", fileDigest)
+        if digest != record["file"]:
+            return True
+        if planned is None:
+            index.setPushedStamp(name, stat)
+        return False
+
+    def albumsync(self, flag=None):
         photos = self.photos
 
         self.keywordSet = set()
@@ -693,19 +2779,44 @@ Updated   : {updated:>4}
         if not getattr(self, "albumFromId", None):
             self.flGetAlbums(contents=True, albums=flag, touchMain=False)
 
-        updated = 0
-        unchanged = 0
-        self.albumAdditions = {}
-        self.albumDeletions = {}
+        C = self.C
+        mainAlbum = C.albumName
+        defaultKeywords = set(C.metaDefaults["keywords"])
+        albumPhotos = self.albumPhotos
+        albumAdditions = {}
+        albumDeletions = {}
+        self.albumAdditions = albumAdditions
+        self.albumDeletions = albumDeletions
+
+        # the desired members of an album are the photos with its keyword
+        (keywordsFromPhoto, photosFromKeyword) = self.getKeywordIndex()
+        selected = set(photos)
+        changed = set()
+
+        for (keyword, names) in sorted(photosFromKeyword.items()):
+            if keyword in defaultKeywords:
+                continue
+            current = set() if keyword == mainAlbum else albumPhotos.get(keyword, set())
+            added = sorted((names & selected) - current)
+            if added:
+                albumAdditions[keyword] = added
+                changed |= set(added)
+
+        for (album, names) in sorted(albumPhotos.items()):
+            if album == mainAlbum:
+                continue
+            desired = (
+                set()
+                if album in defaultKeywords
+                else photosFromKeyword.get(album, set())
+            )
+            removed = sorted((names & selected) - desired)
+            if removed:
+                albumDeletions[album] = removed
+                changed |= set(removed)
 
-        for name in photos:
-            inPath = f"{C.photosDir}/{name}.jpg"
-            metadata = getPhotoMeta(inPath, defaults, True)
-            thisUpdated = self.flPutAlbum(name, metadata, detectMetaChange=False)
-            if thisUpdated:
-                updated += 1
-            else:
-                unchanged += 1
+        updated = len(changed)
+        unchanged = len(photos) - updated
 
         console(
             f"""Photo memberships of albums:
@@ -715,6 +2826,7 @@ Updated   : {updated:>4}
         )
         self.flApplyAlbums()
 
+    @timed
     def albumsort(self, flag=None):
         self.flConnect()
         FL = self.FL
@@ -725,33 +2837,92 @@ Updated   : {updated:>4}
             self.flGetAlbums(contents=False, albums=flag, touchMain=False)
 
         albumFromId = self.albumFromId
+        bulk = self.options.get("bulk", False)
+        localDates = self.options.get("local-dates", False)
+
+        if localDates:
+            # the dates are known locally, the albums come from the snapshot
+            self.getDates()
+            photoDates = self.photoDates
+            albumPhotos = self.flGetAlbumContents(albumFromId)
+            for photos in albumPhotos.values():
+                for photo in photos:
+                    photo["datetaken"] = photoDates.get(photo["title"], "")
+        elif bulk:
+            # the dates come from the account, the albums from the snapshot
+            account = self.flGetAccount()
+            albumPhotos = self.flGetAlbumContents(albumFromId)
+            for photos in albumPhotos.values():
+                for photo in photos:
+                    info = account.get(photo["id"], {})
+                    photo["datetaken"] = info.get("datetaken", "")
+        else:
+            albumPhotos = self.flGetAlbumPhotos(list(albumFromId), withDates=True)
+
+        unchanged = 0
+        reordered = 0
 
         for (albumId, albumTitle) in sorted(albumFromId.items(), key=lambda x: x[1]):
-            photos = sorted(
-                self.flGetPhotos(albumId, withDates=True),
-                key=lambda p: p.get("datetaken", ""),
-            )
+            photos = albumPhotos[albumId]
+            currentIds = [photo["id"] for photo in photos]
+            photoIds = [
+                photo["id"]
+                for photo in sorted(photos, key=lambda p: p.get("datetaken", ""))
+            ]
+            if photoIds == currentIds:
+                unchanged += 1
+                continue
+
             console(f"\tsorting album {albumTitle} with {len(photos)} photos")
-            photoIds = ",".join(photo["id"] for photo in photos)
-            self.wait()
-            FL.photosets.reorderPhotos(photoset_id=albumId, photo_ids=photoIds)
+            self.flChange(
+                "photosets.reorderPhotos",
+                FL.photosets.reorderPhotos,
+                photoset_id=albumId,
+                photo_ids=",".join(photoIds),
+            )
+            reordered += 1
+            if bulk or localDates:
+                self.getSnapshot().setPhotos(albumId, albumTitle, photoIds)
+
+        if reordered and (bulk or localDates):
+            self.flSnapshotDates()
+
+        console(
+            f"""Sorted albums on Flickr
+Unchanged : {unchanged:>4}
+Reordered : {reordered:>4}
+"""
+        )
 
-    def flGetAlbums(self, contents=True, albums=None, touchMain=True):
+    @timed
+    def flGetAlbums(
+        self, contents=True, albums=None, touchMain=True, readKeywords=True
+    ):
         C = self.C
         mainAlbum = C.albumName
 
         selectedAlbums = None if albums is None else set(albums.split(","))
 
-        self.getKeywords()
+        if readKeywords:
+            self.getKeywords()
         allKeywordSet = self.allKeywordSet
 
         self.flConnect()
         FL = self.FL
 
-        self.wait()
-        allAlbums = FL.photosets.getList(user_id=C.flickrUserId)["photosets"][
-            "photoset"
-        ]
+        snapshot = self.getSnapshot() if contents else None
+        if snapshot is not None:
+            self.flGetUpdated(snapshot)
+
+        allAlbums = self.flCall(FL.photosets.getList, user_id=C.flickrUserId)[
+            "photosets"
+        ]["photoset"]
+        if snapshot is not None:
+            snapshot.keep(album["id"] for album in allAlbums)
+        self.albumInfo = {album["id"]: album for album in allAlbums}
+        self.allAlbumIds = {
+            album["title"]["_content"]: album["id"] for album in allAlbums
+        }
         idFromAlbum = {}
         albumFromId = {}
         albumPrimary = {}
@@ -766,6 +2937,8 @@ Updated   : {updated:>4}
         self.albumsFromPhoto = albumsFromPhoto
         self.albumPrimary = albumPrimary
         self.albumPhotos = albumPhotos
+        albumOrder = {}
+        self.albumOrder = albumOrder
 
         self.touchedAlbums = {}
 
@@ -783,12 +2956,15 @@ Updated   : {updated:>4}
             if touchMain and albumTitle == mainAlbum:
                 self.touchedAlbums[albumId] = albumTitle
 
+        if contents:
+            known = self.flGetAlbumContents(albumFromId)
+
         console("Albums on Flickr")
         for (albumId, albumTitle) in sorted(albumFromId.items(), key=lambda x: x[1]):
             isMain = albumTitle == mainAlbum
 
             if contents:
-                photos = self.flGetPhotos(albumId, withDates=False)
+                photos = known[albumId]
                 for photo in photos:
                     fileName = photo["title"]
                     if isMain:
@@ -798,6 +2974,7 @@ Updated   : {updated:>4}
                     else:
                         albumsFromPhoto.setdefault(fileName, set()).add(albumTitle)
                     albumPhotos.setdefault(albumTitle, set()).add(fileName)
+                albumOrder[albumTitle] = [photo["id"] for photo in photos]
                 console(f"\t{albumTitle:<25} {len(photos):>4} photos")
             else:
                 console(f"\t{albumTitle}")
@@ -807,44 +2984,232 @@ Updated   : {updated:>4}
             console(f"\tTotal: {len(nameFromId):>4} photos on Flickr")
             console(f"\tTotal: {len(idFromName):>4} titles on Flickr")
 
-    def flGetPhotos(self, albumId, withDates=False):
+    def flGetAlbumContents(self, albums):
+        """The photos of albums, from the snapshot where it is still valid.
+
+        `albums` maps album ids to album titles.
+        Returns the photos per album id, in the order of Flickr.
+        """
+        albumInfo = self.albumInfo
+        snapshot = self.getSnapshot()
+
+        known = {}
+        for albumId in albums:
+            album = albumInfo[albumId]
+            size = int(album["photos"]) + int(album.get("videos", 0))
+            known[albumId] = snapshot.getAlbum(albumId, album["date_update"], size)
+
+        fetched = self.flGetAlbumPhotos(
+            [albumId for (albumId, photos) in known.items() if photos is None]
+        )
+        for (albumId, photos) in fetched.items():
+            dateUpdate = albumInfo[albumId]["date_update"]
+            snapshot.putAlbum(albumId, albums[albumId], dateUpdate, photos)
+            known[albumId] = photos
+
+        return known
+
+    def flGetUpdated(self, snapshot):
+        """Fetch the titles of the photos that have changed since the snapshot.
+
+        In bulk mode, the titles of all photos are fetched in one listing.
+        """
+        FL = self.FL
+
+        start = int(datetime.now().timestamp())
+
+        if self.options.get("bulk", False):
+            snapshot.setTitles(self.flGetAccount().values())
+        elif snapshot.updated is not None:
+            (photos,) = self.flGetPages(
+                FL.photos.recentlyUpdated, "photos", [dict(min_date=snapshot.updated)]
+            )
+            snapshot.setTitles(photos)
+
+        snapshot.updated = start
+
+    def flGetAccount(self):
+        """Fetch all photos of the account, with the extras that updatr needs."""
+        C = self.C
+        FL = self.FL
+
+        if getattr(self, "accountPhotos", None) is None:
+            (photos,) = self.flGetPages(
+                FL.people.getPhotos,
+                "photos",
+                [dict(user_id=C.flickrUserId, extras=ACCOUNT_EXTRAS)],
+            )
+            self.accountPhotos = {photo["id"]: photo for photo in photos}
+            console(f"\tTotal: {len(photos):>4} photos in the account on Flickr")
+        return self.accountPhotos
+
+    def flGetAlbumPhotos(self, albumIds, withDates=False):
         C = self.C
         FL = self.FL
 
-        self.wait()
         extras = dict(extras="date_taken") if withDates else {}
-        data = FL.photosets.getPhotos(
-            user_id=C.flickrUserId, photoset_id=albumId, **extras
-        )["photoset"]
-        nPages = data["pages"]
-        photos = data["photo"]
-        if nPages > 1:
-            for p in range(2, nPages + 1):
-                self.wait()
-                data = FL.photosets.getPhotos(
-                    user_id=C.flickrUserId, photoset_id=albumId, page=p, **extras
-                )["photoset"]
-                photos.extend(data["photo"])
+        listings = [
+            dict(user_id=C.flickrUserId, photoset_id=albumId, **extras)
+            for albumId in albumIds
+        ]
+        return dict(
+            zip(albumIds, self.flGetPages(FL.photosets.getPhotos, "photoset", listings))
+        )
+
+    def flGetPages(self, method, key, listings):
+        """Fetch listings from Flickr, several pages at the same time.
+
+        `listings` holds the arguments of each listing for `method`,
+        `key` is the part of the response that holds the listing.
+
+        First the first page of every listing is fetched, which tells how many
+        pages it has, then all remaining pages.
+        The workers share the rate limiter, and there are as many of them as
+        calls that the limiter allows in a burst.
+
+        Returns the photos per listing, in the order of Flickr.
+        """
+        workers = max(1, self.limiter.burst)
+
+        def getPage(listing, page):
+            return self.flCall(method, page=page, per_page=PER_PAGE, **listing)[key]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(getPage, listing, 1) for listing in listings]
+            firsts = [future.result() for future in futures]
+
+            pages = [
+                (i, page)
+                for (i, data) in enumerate(firsts)
+                for page in range(2, data["pages"] + 1)
+            ]
+            futures = [
+                executor.submit(getPage, listings[i], page) for (i, page) in pages
+            ]
+            rest = [future.result() for future in futures]
+
+        photos = [list(data["photo"]) for data in firsts]
+        for ((i, page), data) in zip(pages, rest):
+            photos[i].extend(data["photo"])
         return photos
 
-    def flPutPhoto(self, name, metadata):
+    def flUploadPhoto(self, name, force=False):
+        """Put a photo and its metadata on Flickr and record that it is there.
+
+        Returns None once it is on Flickr, otherwise the error that stopped it,
+        as text; then the photo counts as changed in the next sync.
+        """
+        C = self.C
+        index = self.index
+        inPath = f"{C.photosDir}/{name}.jpg"
+
+        try:
+            pushed = self.flPutPhoto(name, self.getMeta(name, True), force=force)
+        except Exception as e:
+            # make sure this photo counts as changed in the next sync
+            if self.planned is None:
+                index.unsetPushed(name)
+            return f"{type(e).__name__}: {e}"
+
+        if self.planned is None:
+            photoId = self.idFromName[name]
+            stat = os.stat(inPath)
+            digest = index.digest(inPath, "file", fileDigest)
+            index.setPushed(name, photoId, stat, digest, pushed)
+            if self.journal is not None:
+                self.journal.putPhoto(name, photoId, digest, pushed)
+        return None
+
+    @timed
+    def flPutPhoto(self, name, metadata, force=False):
+        """Put a photo and its metadata on Flickr with as little as possible.
+
+        The photo file is only uploaded if its pixels or metadata fields that
+        Flickr can only get from the file have changed since the last push.
+        Otherwise only the fields in FLICKR_FIELDS that have changed are set.
+        If `force`, or if nothing is known of the last push, the file is uploaded.
+
+        Returns the digests of what has been pushed, see `pushDigests`.
+        """
         C = self.C
         FL = self.FL
+        index = self.index
 
         idFromName = self.idFromName
 
         photoId = idFromName[name]
         inPath = f"{C.photosDir}/{name}.jpg"
 
-        with open(inPath, "rb") as fh:
-            self.wait()
-            FL.replace(inPath, photoId, fh, format="rest")
-        description = metadata.get("caption", "")
-        self.wait()
-        FL.photos.setMeta(photo_id=photoId, description=description)
-        keywords = metadata.get("keywords", [])
-        self.wait()
-        FL.photos.setTags(photo_id=photoId, tags=" ".join(keywords))
+        digests = pushDigests(metadata, index.digest(inPath, "pixels", pixelDigest))
+        record = None if force else index.getPushed(name)
+        # a record of another photo with the same name does not count
+        pushed = (
+            {}
+            if record is None or record["photoId"] not in {None, photoId}
+            else record["pushed"]
+        )
+        changed = {
+            field for (field, digest) in digests.items() if pushed.get(field) != digest
+        }
+
+        if "file" in changed:
+
+            def replace(photo_id):
+                with open(inPath, "rb") as fh:
+                    FL.replace(inPath, photo_id, fh, format="rest")
+
+            self.flChange(
+                "replace", replace, size=os.path.getsize(inPath), photo_id=photoId
+            )
+            # Flickr gets the date and location from the file,
+            # but not the caption and the keywords
+            changed |= {"caption", "keywords"}
+        else:
+            if "location" in changed:
+                location = flickrLocation(metadata.get("location", ""))
+                if location is None:
+                    self.flChange(
+                        "photos.geo.removeLocation",
+                        FL.photos.geo.removeLocation,
+                        photo_id=photoId,
+                    )
+                else:
+                    (lat, lon) = location
+                    self.flChange(
+                        "photos.geo.setLocation",
+                        FL.photos.geo.setLocation,
+                        photo_id=photoId,
+                        lat=lat,
+                        lon=lon,
+                    )
+            if "datetime" in changed and metadata.get("datetime", ""):
+                self.flChange(
+                    "photos.setDates",
+                    FL.photos.setDates,
+                    photo_id=photoId,
+                    date_taken=flickrDate(metadata["datetime"]),
+                )
+
+        if "caption" in changed:
+            description = metadata.get("caption", "")
+            self.flChange(
+                "photos.setMeta",
+                FL.photos.setMeta,
+                photo_id=photoId,
+                description=description,
+            )
+        if "keywords" in changed:
+            keywords = metadata.get("keywords", [])
+            self.flChange(
+                "photos.setTags",
+                FL.photos.setTags,
+                photo_id=photoId,
+                tags=" ".join(keywords),
+            )
+
+        if "file" not in changed:
+            self.uploadsSaved.append(os.path.getsize(inPath))
+        return digests
 
     def flPutAlbum(self, name, metadata, detectMetaChange=True):
         idFromAlbum = self.idFromAlbum
@@ -884,8 +3249,9 @@ Updated   : {updated:>4}
 
         return updated
 
+    @timed
     def flApplyAlbums(self):
-        FL = self.FL
+        snapshot = self.getSnapshot()
         albumAdditions = self.albumAdditions
         albumDeletions = self.albumDeletions
         touchedAlbums = self.touchedAlbums
@@ -895,11 +3261,15 @@ Updated   : {updated:>4}
         albumFromId = self.albumFromId
         albumPhotos = self.albumPhotos
         albumPrimary = self.albumPrimary
+        albumOrder = self.albumOrder
+        journal = self.journal
 
         console("Collect photos to add to albums")
 
         for (album, names) in sorted(albumAdditions.items()):
             albumId = idFromAlbum.get(album, None)
+            if albumId is None:
+                albumId = self.flFindAlbum(album)
             newalbum = "new " if albumId is None else ""
             plural = "" if len(names) == 1 else "s"
             console(f"\tadd to {newalbum}{album}: {len(names)} photo{plural}")
@@ -942,56 +3312,225 @@ Updated   : {updated:>4}
             self.getDates()
             photoDates = self.photoDates
 
+            edited = dict(full=0, delta=0, none=0)
+            replayed = 0
+
             for (albumId, album) in sorted(touchedAlbums.items()):
+                current = albumOrder.get(album, [])
+                position = {photoId: i for (i, photoId) in enumerate(current)}
                 primary = albumPrimary[album]
                 primaryName = nameFromId[primary]
-                names = sorted(albumPhotos[album], key=lambda n: photoDates[n])
+                # photos with the same date keep their current order
+                names = sorted(
+                    albumPhotos[album],
+                    key=lambda n: (
+                        photoDates[n],
+                        position.get(idFromName[n], len(position)),
+                    ),
+                )
                 if primaryName not in albumPhotos[album]:
                     primaryName = names[0]
                     primary = idFromName[primaryName]
                 plural = "" if len(names) == 1 else "s"
                 console(f"\tsyncing {album}: {len(names)} photo{plural}")
-                photoIds = ",".join(idFromName[name] for name in names)
-                self.wait()
-                FL.photosets.editPhotos(
-                    photoset_id=albumId, primary_photo_id=primary, photo_ids=photoIds
-                )
+                photoIds = [idFromName[name] for name in names]
+                if journal is not None and journal.hasAlbum(albumId, primary, photoIds):
+                    # already edited by the interrupted sync
+                    how = "none"
+                    replayed += 1
+                    changed = True
+                else:
+                    how = self.flEditAlbum(albumId, current, photoIds, primary)
+                    changed = how != "none"
+                    if journal is not None and changed:
+                        journal.putAlbum(albumId, primary, photoIds)
+                edited[how] += 1
+                albumPrimary[album] = primary
+                albumOrder[album] = photoIds
+                # an unchanged album keeps its date of update in the snapshot
+                if changed:
+                    snapshot.setPhotos(albumId, album, photoIds)
+
+            if edited["full"] or edited["delta"] or replayed:
+                self.flSnapshotDates()
+            console(
+                f"""Albums on Flickr
+Unchanged : {edited["none"]:>4}
+Edited    : {edited["full"]:>4} in full
+Edited    : {edited["delta"]:>4} photo by photo
+"""
+            )
         else:
             console("No album changes to sync with Flickr")
 
+    def flEditAlbum(self, albumId, current, target, primary):
+        """Give an album on Flickr the photos of `target`, in that order.
+
+        `current` are the photos in the album now, in their order.
+        The album is edited in the way that `albumEdit` finds cheapest.
+
+        Returns `full`, `delta` or `none`, for what has been done.
+        """
+        FL = self.FL
+        albumPrimary = self.albumPrimary
+        albumFromId = self.albumFromId
+
+        newPrimary = primary != albumPrimary[albumFromId[albumId]]
+        (how, added, removed, k) = albumEdit(current, target, newPrimary)
+
+        if how == "full":
+            self.flChange(
+                "photosets.editPhotos",
+                FL.photosets.editPhotos,
+                photoset_id=albumId,
+                primary_photo_id=primary,
+                photo_ids=",".join(target),
+            )
+            return how
+
+        if how == "none":
+            return how
+
+        for photoId in added:
+            self.flChange(
+                "photosets.addPhoto",
+                FL.photosets.addPhoto,
+                photoset_id=albumId,
+                photo_id=photoId,
+            )
+        if newPrimary:
+            self.flChange(
+                "photosets.setPrimaryPhoto",
+                FL.photosets.setPrimaryPhoto,
+                photoset_id=albumId,
+                photo_id=primary,
+            )
+        for chunk in chunks(removed, MAX_IDS):
+            self.flChange(
+                "photosets.removePhotos",
+                FL.photosets.removePhotos,
+                photoset_id=albumId,
+                photo_ids=",".join(chunk),
+            )
+        # every reorder puts its photos in front of the others,
+        # so the last chunk goes first
+        for chunk in reversed(chunks(target[0:k], MAX_IDS)):
+            self.flChange(
+                "photosets.reorderPhotos",
+                FL.photosets.reorderPhotos,
+                photoset_id=albumId,
+                photo_ids=",".join(chunk),
+            )
+        return how
+
+    def flSnapshotDates(self):
+        """Learn the date_update of the albums that we have just changed."""
+        C = self.C
+        FL = self.FL
+
+        if self.planned is not None:
+            return
+
+        allAlbums = self.flCall(FL.photosets.getList, user_id=C.flickrUserId)[
+            "photosets"
+        ]["photoset"]
+        self.getSnapshot().setDates(allAlbums)
+
+    def flFindAlbum(self, name):
+        """Take in an album on Flickr that has not been fetched yet.
+
+        Only the albums of the keywords known at the start are fetched,
+        but a keyword that comes in later may have an album on Flickr as well.
+        Its photos are fetched now.
+        Returns the id of the album, or None if there is no such album.
+        """
+        albumId = self.allAlbumIds.get(name, None)
+        if albumId is None:
+            return None
+
+        photos = self.flGetAlbumContents({albumId: name})[albumId]
+        self.idFromAlbum[name] = albumId
+        self.albumFromId[albumId] = name
+        self.albumPhotos[name] = {photo["title"] for photo in photos}
+        self.albumOrder[name] = [photo["id"] for photo in photos]
+        for photo in photos:
+            self.albumsFromPhoto.setdefault(photo["title"], set()).add(name)
+        return albumId
+
     def flMakeAlbum(self, name, photoId):
         FL = self.FL
         albumFromId = self.albumFromId
         idFromAlbum = self.idFromAlbum
 
-        self.wait()
-        result = FL.photosets.create(title=name, primary_photo_id=photoId)
-        albumId = result["photoset"]["id"]
+        result = self.flChange(
+            "photosets.create",
+            FL.photosets.create,
+            title=name,
+            primary_photo_id=photoId,
+        )
+        # in a dry run the album is not made, so it has no id yet
+        albumId = f"new:{name}" if result is None else result["photoset"]["id"]
         albumFromId[albumId] = name
         idFromAlbum[name] = albumId
+        self.albumOrder[name] = [photoId]
+        self.getSnapshot().setPhotos(albumId, name, [photoId])
         return albumId
 
     def flConnect(self):
-        C = self.C
         if not getattr(self, "FL", None):
-            FL = flickrapi.FlickrAPI(
-                C.flickrKey, C.flickrSecret, format="parsed-json", cache=CACHE
-            )
-
-            if not FL.token_valid(perms="write"):
-                FL.get_request_token(oauth_callback="oob")
-                authorize_url = FL.auth_url(perms="write")
-                webbrowser.open_new_tab(authorize_url)
-                verifier = str(input("Verifier code: "))
-                FL.get_access_token(verifier)
-            self.FL = FL
+            self.FL = self.flickr(self.C, self.allPhotos)
 
     def wait(self):
         sys.stdout.write(".")
-        delay = 0.2
-        sleep(delay)
+        self.limiter.acquire()
+
+    def flCall(self, method, *args, size=0, **kwargs):
+        """Call Flickr within the rate limit.
+
+        If Flickr says we are going too fast, back off and try again.
+        `size` is the number of bytes that the call uploads, for the profile.
+        """
+        limiter = self.limiter
+        profile = self.profile
+        name = flickrMethod(method)
+        attempt = 0
+
+        while True:
+            self.wait()
+            start = perf_counter()
+            error = True
+            try:
+                result = method(*args, **kwargs)
+                error = False
+                return result
+            except flickrapi.exceptions.FlickrError as e:
+                if not isRateLimited(e) or attempt >= limiter.retries:
+                    raise
+                pause = limiter.backoff(attempt)
+                console(f"\tFlickr rate limit hit, pausing {pause}s", error=True)
+                attempt += 1
+            finally:
+                profile.call(name, perf_counter() - start, size, error)
+
+    def flChange(self, what, method, *args, size=0, **kwargs):
+        """Make a change on Flickr, or, in a dry run, only add it to the plan.
+
+        `what` names the Flickr method, and `size` is the number of bytes
+        that the change uploads.
+        Returns what Flickr returns, in a dry run None.
+        """
+        planned = self.planned
+
+        if planned is not None:
+            planned.add(what, size, **kwargs)
+            return None
+        return self.flCall(method, *args, size=size, **kwargs)
 
     def getFlickrUpdated(self):
+        """When Flickr has last been synced according to earlier versions.
+
+        They did not keep records per photo, only this time.
+        """
         source = self.source
         flickrUpdated = None
         flUpdatePath = f"{LOCAL_DIR}/{source}-{FLICKR_UPDATED_FILE}"
@@ -1000,16 +3539,8 @@ Updated   : {updated:>4}
                 flickrUpdated = fh.read()
             flickrUpdated = datetime.fromisoformat(flickrUpdated.strip())
             console(f"Flickr last updated on {flickrUpdated.isoformat()}")
-        else:
-            console("Flickr not previously updated")
         return flickrUpdated
 
-    def setFlickrUpdated(self):
-        source = self.source
-        flUpdatePath = f"{LOCAL_DIR}/{source}-{FLICKR_UPDATED_FILE}"
-        with open(flUpdatePath, "w") as fh:
-            fh.write(datetime.now().isoformat())
-
 
 def main():
     A = readArgs()
@@ -1020,11 +3551,12 @@ def main():
     name = A.name
     command = A.command
     flag = A.flag
+    options = A.options
 
     if not source:
         return
 
-    Mk = Make(source, name)
+    Mk = Make(source, name, options=options)
 
     return Mk.doCommand(command, flag=flag)
 